@@ -3,18 +3,49 @@ AI Handler for Meshtastic AI DM Bot.
 Manages Google Gemini API interactions and response generation with per-user chat context.
 """
 
+import asyncio
+import collections
+import json
 import logging
+import random
+import re
+import sqlite3
+import threading
 import time
 from typing import Optional, Dict, List
 
 import google.generativeai as genai
 
+# numpy is only needed for the semantic response cache; degrade to the
+# exact-match cache when it isn't installed.
+try:
+    import numpy as np
+    HAVE_NUMPY = True
+except Exception:
+    HAVE_NUMPY = False
+
 logger = logging.getLogger(__name__)
 
+# Collapse any run of whitespace to a single space (C-level, one output buffer).
+_WS_RE = re.compile(r'\s+')
+
+# genai keeps one shared transport channel per configure() call; remember the
+# last key we configured with so repeated _setup_model calls (multiple
+# handlers, config updates) reuse the pooled connection instead of rebuilding it.
+_configured_api_key: Optional[str] = None
+
 
 class AIHandler:
     """Handles AI interactions using Google Gemini with per-user chat sessions."""
-    
+
+    # Constant tail appended to every prompt; kept at class level so the
+    # per-call concatenation is a single str +.
+    _CONCISE_SUFFIX = (
+        "\n\n(Reply concisely per rules: ~250–450 chars total; never under 200 or over 600; "
+        "use 1–3 short bullets or a compact paragraph; no fluff.)"
+    )
+
+
     def __init__(self, api_key: str, model_name: str = "gemini-1.5-flash"):
         """
         Initialize AI handler.
@@ -30,6 +61,20 @@ class AIHandler:
         # Retry policy
         self.max_retries = 3
         self.retry_delay = 1.0
+        self.max_retry_delay = 8.0
+
+        # Token-bucket rate limits: per-user (1/min, burst 5) so one spammy
+        # node can't exhaust quota, plus a global bucket sized to the Gemini
+        # requests-per-minute limit so retries only fire on real transients.
+        self.user_bucket_rate = 1.0 / 60.0
+        self.user_bucket_burst = 5.0
+        self.global_bucket_rate = 1.0
+        self.global_bucket_burst = 10.0
+        self._buckets: Dict[str, tuple] = {}  # user_id -> (tokens, last_refill)
+        self._global_bucket = (self.global_bucket_burst, time.monotonic())
+        # Bucket reads-modify-writes race across the worker pool without
+        # this: concurrent debits can be lost, blowing the RPM budget.
+        self._bucket_lock = threading.Lock()
 
         # Length targets (characters)
         self.min_chars = 200
@@ -46,10 +91,40 @@ class AIHandler:
             "max_output_tokens": 200,
         }
 
-        # In-memory chat sessions keyed by user_id (string)
-        self._chats: Dict[str, any] = {}
-
-        # One-time brevity preamble injected when a new chat is created.
+        # In-memory chat sessions keyed by user_id (string).
+        # Bounded LRU: OrderedDict gives O(1) recency updates and eviction;
+        # idle sessions are also dropped after chat_session_ttl seconds.
+        self._chats: "collections.OrderedDict[str, any]" = collections.OrderedDict()
+        self._chat_ts: Dict[str, float] = {}
+        # Several worker threads call chat_respond concurrently; every
+        # mutation/iteration of the two dicts above happens under this lock
+        # (never held across a network call).
+        self._chat_lock = threading.Lock()
+        self.max_chat_sessions = 500
+        self.chat_session_ttl = 3600.0
+        # Sliding context window: keep at most this many user/model pairs so
+        # per-turn input tokens stay bounded as conversations grow.
+        self.max_turns = 8
+
+        # On-disk chat history so restarts don't re-pay the preamble tokens.
+        self.chats_db_file = "chats.db"
+        self._db_lock = threading.Lock()
+        self._db = self._open_chats_db()
+
+        # Response cache: exact normalized-prompt hits plus an embedding-based
+        # nearest-neighbor fallback for FAQ-style rephrasings. Both are keyed
+        # per user — chat replies depend on that user's conversation ("yes",
+        # "tell me more"), so a hit must never cross users.
+        self._cache: Dict[tuple, str] = {}  # (user_id, normalized) -> response
+        self._embed_cache: Dict[str, "collections.deque"] = {}  # user_id -> deque[(vec, response)]
+        self._cache_lock = threading.Lock()
+        self.cache_max_entries = 256
+        self.embed_cache_per_user = 16
+        self.embed_cache_max_users = 64
+        self.cache_similarity_threshold = 0.92
+        self.embedding_model = "models/text-embedding-004"
+
+        # Brevity rules, passed to the model as system_instruction.
         self._brevity_preamble = (
             "You are a Meshtastic DM bot with strict brevity rules.\n"
             "- Aim for ~250–450 characters total.\n"
@@ -63,45 +138,137 @@ class AIHandler:
 
     def _setup_model(self):
         """Initialize the Gemini model."""
+        global _configured_api_key
         try:
-            genai.configure(api_key=self.api_key)
+            if _configured_api_key != self.api_key:
+                genai.configure(api_key=self.api_key)
+                _configured_api_key = self.api_key
             self.model = genai.GenerativeModel(
                 model_name=self.model_name,
                 generation_config=self.generation_config,
+                system_instruction=self._brevity_preamble,
             )
             logger.info(f"Gemini model '{self.model_name}' initialized successfully")
         except Exception as e:
             logger.error(f"Failed to initialize Gemini model: {e}")
             raise
 
+    # ---- chat history persistence ----
+
+    def _open_chats_db(self) -> Optional[sqlite3.Connection]:
+        try:
+            db = sqlite3.connect(self.chats_db_file, check_same_thread=False)
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS chats "
+                "(user_id TEXT PRIMARY KEY, history_json TEXT, last_used REAL)"
+            )
+            db.commit()
+            return db
+        except Exception as e:
+            logger.warning(f"Could not open chat history db: {e}")
+            return None
+
+    @staticmethod
+    def _history_to_jsonable(history) -> List[dict]:
+        """Convert SDK history entries to plain role/parts dicts."""
+        out: List[dict] = []
+        for entry in history or []:
+            role = getattr(entry, "role", None) or (entry.get("role") if isinstance(entry, dict) else "user")
+            parts = getattr(entry, "parts", None) or (entry.get("parts") if isinstance(entry, dict) else [])
+            texts = []
+            for p in parts or []:
+                t = getattr(p, "text", None)
+                if t is None and isinstance(p, (str, bytes)):
+                    t = p if isinstance(p, str) else p.decode("utf-8", errors="ignore")
+                if t:
+                    texts.append(t)
+            if texts:
+                out.append({"role": role, "parts": texts})
+        return out
+
+    def _load_persisted_history(self, user_id: str) -> Optional[List[dict]]:
+        if not self._db:
+            return None
+        try:
+            with self._db_lock:
+                row = self._db.execute(
+                    "SELECT history_json FROM chats WHERE user_id = ?", (user_id,)
+                ).fetchone()
+            if row and row[0]:
+                history = json.loads(row[0])
+                if isinstance(history, list) and history:
+                    return history
+        except Exception as e:
+            logger.warning(f"Could not load persisted chat history: {e}")
+        return None
+
+    def _persist_chat(self, user_id: str, chat):
+        """Upsert the user's chat history; runs off the reply path."""
+        if not self._db:
+            return
+        try:
+            history_json = json.dumps(self._history_to_jsonable(getattr(chat, "history", [])))
+            with self._db_lock:
+                self._db.execute(
+                    "INSERT INTO chats (user_id, history_json, last_used) VALUES (?, ?, ?) "
+                    "ON CONFLICT(user_id) DO UPDATE SET history_json = excluded.history_json, "
+                    "last_used = excluded.last_used",
+                    (user_id, history_json, time.time()),
+                )
+                self._db.commit()
+        except Exception as e:
+            logger.warning(f"Could not persist chat history: {e}")
+
+    def _evict_stale_chats(self, now: float):
+        """Drop chats idle past the TTL, then enforce the LRU size cap.
+
+        Caller must hold _chat_lock: this iterates _chat_ts, and a concurrent
+        insert from another worker would blow up the iteration.
+        """
+        stale = [uid for uid, ts in self._chat_ts.items() if now - ts > self.chat_session_ttl]
+        for uid in stale:
+            self._chats.pop(uid, None)
+            self._chat_ts.pop(uid, None)
+        while len(self._chats) > self.max_chat_sessions:
+            uid, _ = self._chats.popitem(last=False)
+            self._chat_ts.pop(uid, None)
+
     def _get_or_create_chat(self, user_id: str):
         """Return an existing chat session or create a new one for user_id."""
-        chat = self._chats.get(user_id)
-        if chat is None:
-            chat = self.model.start_chat(
-                history=[
-                    {"role": "user", "parts": [self._brevity_preamble]},
-                    {"role": "model", "parts": ["OK"]},
-                ]
-            )
-            self._chats[user_id] = chat
+        now = time.monotonic()
+        with self._chat_lock:
+            chat = self._chats.get(user_id)
+            if chat is None:
+                # Brevity rules ride along as system_instruction, so new chats
+                # start empty instead of paying a synthetic two-turn preamble.
+                history = self._load_persisted_history(user_id) or []
+                chat = self.model.start_chat(history=history)
+                self._chats[user_id] = chat
+                self._evict_stale_chats(now)
+            else:
+                self._chats.move_to_end(user_id)
+            self._chat_ts[user_id] = now
         return chat
 
     @staticmethod
     def _extract_text(response) -> str:
         """Extract text robustly from a Gemini response object."""
-        # Preferred: response.text
+        # Common path: response.text works — one guarded attribute read.
         try:
-            if hasattr(response, "text") and response.text:
-                return response.text
+            text = getattr(response, "text", None)
         except Exception:
-            pass
+            # .text is a property and can raise on blocked/empty responses
+            text = None
+        if text:
+            return text
 
         # Fallback: dig through candidates/parts if available
         try:
-            cand0 = getattr(response, "candidates", [None])[0]
-            if cand0 and hasattr(cand0, "content"):
-                parts = getattr(cand0.content, "parts", []) or []
+            candidates = getattr(response, "candidates", None)
+            cand0 = candidates[0] if candidates else None
+            content = getattr(cand0, "content", None)
+            if content is not None:
+                parts = content.parts or []
                 texts: List[str] = []
                 for p in parts:
                     t = getattr(p, "text", None)
@@ -117,8 +284,104 @@ class AIHandler:
         # Last resort: string cast
         return str(response)
 
+    def _backoff_delay(self, attempt: int, exc: Exception) -> float:
+        """Exponential backoff with jitter; honor a server-provided retry hint."""
+        retry_after = getattr(exc, "retry_after", None)
+        if isinstance(retry_after, (int, float)) and retry_after > 0:
+            return float(retry_after)
+        delay = self.retry_delay * (2 ** attempt) * (0.5 + random.random())
+        return min(delay, self.max_retry_delay)
+
+    # ---- rate limiting ----
+
+    @staticmethod
+    def _refill(tokens: float, last: float, rate: float, burst: float, now: float) -> float:
+        return min(burst, tokens + (now - last) * rate)
+
+    def _take_token(self, user_id: str) -> bool:
+        """Debit one token from the user's and the global bucket."""
+        now = time.monotonic()
+
+        with self._bucket_lock:
+            tokens, last = self._buckets.get(user_id, (self.user_bucket_burst, now))
+            tokens = self._refill(tokens, last, self.user_bucket_rate, self.user_bucket_burst, now)
+            if tokens < 1.0:
+                self._buckets[user_id] = (tokens, now)
+                return False
+
+            g_tokens, g_last = self._global_bucket
+            g_tokens = self._refill(g_tokens, g_last, self.global_bucket_rate, self.global_bucket_burst, now)
+            if g_tokens < 1.0:
+                self._global_bucket = (g_tokens, now)
+                return False
+
+            self._buckets[user_id] = (tokens - 1.0, now)
+            self._global_bucket = (g_tokens - 1.0, now)
+        return True
+
+    # ---- response cache ----
+
+    def _normalize_prompt(self, prompt: str) -> str:
+        return self._clean_whitespace(prompt).lower()
+
+    def _embed_prompt(self, normalized: str):
+        """Return a unit embedding vector for the prompt, or None on failure."""
+        if not HAVE_NUMPY:
+            return None
+        try:
+            result = genai.embed_content(model=self.embedding_model, content=normalized)
+            vec = np.asarray(result["embedding"], dtype=np.float32)
+            norm = np.linalg.norm(vec)
+            if norm == 0:
+                return None
+            return vec / norm
+        except Exception as e:
+            logger.debug(f"Prompt embedding failed: {e}")
+            return None
+
+    def _cache_lookup_exact(self, user_id: str, normalized: str) -> Optional[str]:
+        """Free exact-match probe; safe to run before the rate limiter."""
+        with self._cache_lock:
+            return self._cache.get((user_id, normalized))
+
+    async def _cache_lookup_semantic(self, user_id: str, normalized: str):
+        """Return (cached response or None, embedding or None).
+
+        The embedding is a paid network call: it runs on a worker thread so
+        the event loop stays free, and callers only reach it after the rate
+        limiter has debited a token.
+        """
+        vec = await asyncio.to_thread(self._embed_prompt, normalized)
+        # Snapshot the deque under the lock; the similarity math runs on the
+        # copy so the lock never covers more than a list() call.
+        with self._cache_lock:
+            entries = list(self._embed_cache.get(user_id) or ())
+        if vec is not None and entries:
+            matrix = np.stack([v for v, _ in entries])
+            sims = matrix @ vec
+            best = int(sims.argmax())
+            if sims[best] >= self.cache_similarity_threshold:
+                return entries[best][1], vec
+        return None, vec
+
+    def _cache_store(self, user_id: str, normalized: str, response: str, vec=None):
+        with self._cache_lock:
+            if len(self._cache) >= self.cache_max_entries:
+                self._cache.pop(next(iter(self._cache)))
+            self._cache[(user_id, normalized)] = response
+            if vec is not None:
+                dq = self._embed_cache.get(user_id)
+                if dq is None:
+                    if len(self._embed_cache) >= self.embed_cache_max_users:
+                        self._embed_cache.pop(next(iter(self._embed_cache)))
+                    dq = self._embed_cache[user_id] = collections.deque(maxlen=self.embed_cache_per_user)
+                dq.append((vec, response))
+
     def _clean_whitespace(self, s: str) -> str:
-        return " ".join(s.split())
+        return _WS_RE.sub(' ', s).strip()
+
+    # Sentence/line/bullet boundaries we are willing to cut on.
+    _TRIM_RE = re.compile(r'[.!?](?=\s)|\n|\s-\s')
 
     def _trim_to_max_chars(self, s: str) -> str:
         """Trim at sentence boundaries to <= max_chars when possible."""
@@ -126,37 +389,95 @@ class AIHandler:
         if len(s) <= self.max_chars:
             return s
 
-        # Try to trim on sentence end near the max boundary
-        cutoff = self.max_chars
-        candidates = []
-        for p in [". ", "! ", "? ", "\n", " - "]:
-            idx = s.rfind(p, 0, cutoff)
-            if idx != -1:
-                candidates.append(idx + len(p.strip()))
-        if candidates:
-            return s[:max(candidates)].strip()
+        # Single pass over the allowed prefix; keep the last boundary seen.
+        prefix = s[:self.max_chars]
+        cut = 0
+        for m in self._TRIM_RE.finditer(prefix):
+            cut = m.end()
+        if cut:
+            return prefix[:cut].strip()
 
         # Fallback: hard cut
-        return s[:self.max_chars].rstrip()
+        return prefix.rstrip()
 
-    def _ensure_length_bounds(self, chat, base_prompt: str, first_try_text: str) -> str:
+    def _truncate_chat_history(self, user_id: str, chat):
+        """Rebuild the chat on a sliding window once history outgrows max_turns."""
+        try:
+            history = getattr(chat, "history", None) or []
+            if len(history) > 2 * self.max_turns:
+                chat = self.model.start_chat(history=list(history)[-2 * self.max_turns:])
+                with self._chat_lock:
+                    self._chats[user_id] = chat
+        except Exception as e:
+            logger.debug(f"History truncation skipped: {e}")
+        return chat
+
+    async def _stream_text(self, chat, prompt: str) -> str:
+        """
+        Stream the reply and stop reading once we are safely past max_chars;
+        _trim_to_max_chars cleans up the tail. Saves latency and output
+        tokens on replies that would have run long.
+        """
+        stream = await chat.send_message_async(
+            prompt, stream=True, generation_config=self.generation_config
+        )
+        buf: List[str] = []
+        total = 0
+        limit = int(self.max_chars * 1.2)
+        cut_early = False
+        async for chunk in stream:
+            try:
+                t = chunk.text
+            except Exception:
+                t = ""
+            if t:
+                buf.append(t)
+                total += len(t)
+                if total >= limit:
+                    cut_early = True
+                    break
+        if cut_early:
+            # An unresolved stream poisons the ChatSession: .history (read by
+            # the next send_message) raises IncompleteIterationError until the
+            # stream is fully consumed. Drain the tail; it was cut for display,
+            # the tokens are already spent server-side.
+            try:
+                await stream.resolve()
+            except Exception as e:
+                logger.warning(f"Could not resolve cut-off stream: {e}")
+                try:
+                    # Drop the half-recorded turn so the session stays usable.
+                    chat.rewind()
+                except Exception:
+                    pass
+        return "".join(buf)
+
+    async def _ensure_length_bounds(self, chat, base_prompt: str, first_try_text: str) -> str:
         """
         If too short, request one-time expansion. If too long, trim neatly.
+
+        The expansion request is fired as a task immediately so the cleanup
+        and trimming of the first answer overlaps the second round-trip.
         """
+        expand_task = None
+        if len(first_try_text) < self.min_chars:
+            expand_prompt = (
+                "Please expand the previous answer to roughly "
+                f"{self.ideal_low}–{self.ideal_high} characters. "
+                "Do not add fluff; add only essential specifics."
+            )
+            expand_task = asyncio.create_task(
+                chat.send_message_async(expand_prompt, generation_config=self.generation_config)
+            )
+
+        # Independent work runs while the (optional) expansion is in flight.
         text = self._clean_whitespace(first_try_text)
 
-        if len(text) < self.min_chars:
-            # One expansion attempt to reach ~ideal range
+        if expand_task is not None:
             try:
-                expand_prompt = (
-                    "Please expand the previous answer to roughly "
-                    f"{self.ideal_low}–{self.ideal_high} characters. "
-                    "Do not add fluff; add only essential specifics."
-                )
-                resp = chat.send_message(expand_prompt)
-                expanded = self._extract_text(resp).strip()
-                expanded = self._clean_whitespace(expanded) or text
-                text = expanded
+                resp = await expand_task
+                expanded = self._clean_whitespace(self._extract_text(resp).strip())
+                text = expanded or text
             except Exception as e:
                 logger.warning(f"Expansion step failed: {e}")
 
@@ -165,48 +486,100 @@ class AIHandler:
 
         return text
 
-    def chat_respond(self, user_id: str, prompt: str) -> str:
+    async def achat_respond(self, user_id: str, prompt: str) -> str:
         """
-        Send a prompt in the user's chat session and return the response text
-        within 200–600 characters (1–3 Meshtastic frames).
+        Async variant of chat_respond: awaits the Gemini round-trip so one
+        process can service many concurrent DMs without blocking the loop.
         """
         if not self.model:
             raise Exception("AI model not initialized")
 
+        normalized = self._normalize_prompt(prompt)
+        cached = self._cache_lookup_exact(user_id, normalized)
+        if cached is not None:
+            logger.info("AI chat response served from cache")
+            return cached
+
+        if not self._take_token(user_id):
+            logger.warning(f"Rate limit hit for user {user_id}")
+            return "You're sending requests too quickly. Please wait a minute and try again."
+
+        # The semantic probe costs an embedding round trip, so it sits behind
+        # the token check — rate-limited users can't run up upstream spend.
+        prompt_vec = None
+        if HAVE_NUMPY:
+            cached, prompt_vec = await self._cache_lookup_semantic(user_id, normalized)
+            if cached is not None:
+                logger.info("AI chat response served from semantic cache")
+                return cached
+
         chat = self._get_or_create_chat(user_id)
 
-        concise_prompt = (
-            f"{prompt}\n\n"
-            "(Reply concisely per rules: ~250–450 chars total; never under 200 or over 600; "
-            "use 1–3 short bullets or a compact paragraph; no fluff.)"
-        )
+        concise_prompt = prompt + self._CONCISE_SUFFIX
 
         for attempt in range(self.max_retries):
             try:
-                resp = chat.send_message(concise_prompt)
-                raw = self._extract_text(resp).strip()
+                raw = (await self._stream_text(chat, concise_prompt)).strip()
                 if raw:
-                    bounded = self._ensure_length_bounds(chat, concise_prompt, raw)
-                    logger.info(
-                        f"AI chat response (attempt {attempt + 1}) len={len(bounded)}"
-                    )
+                    n = len(raw)
+                    if self.ideal_low <= n <= self.ideal_high and '  ' not in raw and '\n\n' not in raw:
+                        # Already in the ideal band with tidy whitespace —
+                        # skip the expansion/trim machinery entirely.
+                        bounded = raw
+                    else:
+                        bounded = await self._ensure_length_bounds(chat, concise_prompt, raw)
+                    if logger.isEnabledFor(logging.INFO):
+                        logger.info(
+                            f"AI chat response (attempt {attempt + 1}) len={len(bounded)}"
+                        )
+                    self._cache_store(user_id, normalized, bounded, prompt_vec)
+                    chat = self._truncate_chat_history(user_id, chat)
+                    threading.Thread(
+                        target=self._persist_chat, args=(user_id, chat), daemon=True
+                    ).start()
                     return bounded
 
                 logger.warning(f"Empty AI chat response (attempt {attempt + 1})")
             except Exception as e:
                 logger.warning(f"AI chat attempt {attempt + 1} failed: {e}")
                 if attempt < self.max_retries - 1:
-                    time.sleep(self.retry_delay * (attempt + 1))
+                    await asyncio.sleep(self._backoff_delay(attempt, e))
                 else:
                     logger.error("All AI chat attempts failed")
                     raise Exception(f"AI generation failed after {self.max_retries} attempts: {e}")
 
         return "I’m having trouble responding right now. Please try again."
 
+    def chat_respond(self, user_id: str, prompt: str) -> str:
+        """
+        Send a prompt in the user's chat session and return the response text
+        within 200–600 characters (1–3 Meshtastic frames).
+
+        Thin sync wrapper around achat_respond for legacy callers.
+        """
+        return asyncio.run(self.achat_respond(user_id, prompt))
+
+    # ---- one-shot interface ----
+
+    async def agenerate_response(self, prompt: str, user_context: Optional[str] = None) -> str:
+        """
+        One-shot interface: each stateless prompt gets its own API call, so
+        concurrent callers simply overlap on the event loop. (Candidates on a
+        single call are N alternative answers to one conversation, not N
+        independent answers, so prompts must not share a request.)
+        """
+        if user_context is not None:
+            return await self.achat_respond(user_context, prompt)
+        resp = await self.model.generate_content_async(
+            prompt + self._CONCISE_SUFFIX, generation_config=self.generation_config
+        )
+        return self._extract_text(resp).strip()
+
     # Backward-compatible one-shot interface (unused by main but kept for tooling/tests)
     def generate_response(self, prompt: str, user_context: Optional[str] = None) -> str:
-        chat_id = user_context or "default"
-        return self.chat_respond(chat_id, prompt)
+        if user_context is not None:
+            return self.chat_respond(user_context, prompt)
+        return asyncio.run(self.agenerate_response(prompt))
 
     def test_connection(self) -> bool:
         try:
@@ -225,12 +598,24 @@ class AIHandler:
         }
 
     def update_generation_config(self, new_config: dict):
-        """Update generation config and recreate the model (resets chats)."""
+        """
+        Update generation config in place. The live dict is passed per call,
+        so no model re-creation and no chat reset is needed.
+        """
+        self.generation_config.update(new_config)
+        logger.info("Generation configuration updated successfully.")
+
+    def set_model(self, model_name: str):
+        """Switch to a different Gemini model; this does reset chats."""
+        if model_name == self.model_name:
+            return
         try:
-            self.generation_config.update(new_config)
+            self.model_name = model_name
             self._setup_model()
-            self._chats.clear()
-            logger.info("Generation configuration updated successfully; chats reset.")
+            with self._chat_lock:
+                self._chats.clear()
+                self._chat_ts.clear()
+            logger.info(f"Model switched to '{model_name}'; chats reset.")
         except Exception as e:
-            logger.error(f"Failed to update generation configuration: {e}")
+            logger.error(f"Failed to switch model: {e}")
             raise
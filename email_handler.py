@@ -5,23 +5,64 @@ Handles email sending via SMTP, email receiving via IMAP, and email storage/retr
 Supports both OAuth 2.0 (service accounts) and App Passwords for secure Gmail access.
 """
 
+import asyncio
+import io
 import smtplib
 import imaplib
 import email
+import hashlib
 import uuid
 import time
 import logging
 import threading
 import json
 import os
+import queue
+import sqlite3
 import base64
-import random
+import binascii
+import re
 import string
+from collections import deque
+from datetime import datetime, timezone
+from email import policy
+from email.generator import BytesGenerator
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.header import decode_header
 from typing import Dict, Optional, Tuple, List, Union
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass
+
+# aioimaplib is optional; with it the inbox monitor runs on an asyncio loop
+# instead of blocking a thread (and the GIL) in synchronous imaplib reads
+try:
+    import aioimaplib
+    AIOIMAP_AVAILABLE = True
+except ImportError:
+    AIOIMAP_AVAILABLE = False
+
+# uvloop is optional; it swaps asyncio's selector loop for libuv's, which
+# wakes the IDLE monitor from socket readiness with noticeably less latency
+try:
+    import uvloop
+    HAVE_UVLOOP = True
+except ImportError:
+    HAVE_UVLOOP = False
+
+# rapidfuzz is optional; its C++ token_set_ratio makes the fuzzy subject
+# fallback tolerant of reordering and quote noise ("Fwd: Re: foo" vs "foo")
+try:
+    from rapidfuzz import fuzz, process as rf_process
+    HAVE_RAPIDFUZZ = True
+except ImportError:
+    HAVE_RAPIDFUZZ = False
+
+# orjson is optional; it serializes 5-10x faster than stdlib json
+try:
+    import orjson
+    HAVE_ORJSON = True
+except ImportError:
+    HAVE_ORJSON = False
 
 # OAuth 2.0 imports
 try:
@@ -30,6 +71,8 @@ try:
     from google.oauth2 import service_account
     from google_auth_oauthlib.flow import InstalledAppFlow
     from googleapiclient.discovery import build
+    import google_auth_httplib2
+    import httplib2
     OAUTH_AVAILABLE = True
 except ImportError:
     OAUTH_AVAILABLE = False
@@ -44,7 +87,24 @@ SCOPES = [
 
 logger = logging.getLogger(__name__)
 
-@dataclass
+# Leading reply/forward prefixes on subjects, possibly stacked ("Re: Fwd: x").
+# Anchored so "re:" inside a subject is left alone.
+_RE_PREFIX = re.compile(r'^\s*(?:(?:re|fwd|fw)\s*:\s*)+', re.I)
+
+
+def _normalize_subject(s: str) -> str:
+    """Strip leading Re:/Fwd: prefixes and case-fold for subject matching."""
+    return _RE_PREFIX.sub('', s).strip().lower()
+
+
+# URL-safe -> standard base64 alphabet, built once instead of per call
+# inside base64.urlsafe_b64decode
+_B64_TRANS = bytes.maketrans(b'-_', b'+/')
+
+# Bare address inside an RFC 5322 "Display Name <addr@host>" From header
+_ADDR_RE = re.compile(r'<([^>]+)>')
+
+@dataclass(slots=True)
 class EmailMessage:
     """Represents an email message with all necessary metadata."""
     unique_id: str
@@ -52,11 +112,12 @@ class EmailMessage:
     sender_email: str
     recipient_email: str
     subject: str
-    body: str
+    body: Optional[str]  # None = not hydrated; fetched from the store on demand
     timestamp: float
     direction: str  # 'outgoing' or 'incoming'
     reply_to_id: Optional[str] = None  # For replies to track conversation threads
     message_id: Optional[str] = None  # For email threading (In-Reply-To, References)
+    status: str = 'sent'  # 'pending' | 'sent' | 'failed' (outgoing only)
 
 class EmailHandler:
     """Handles all email operations for the Meshtastic bot with secure authentication."""
@@ -85,18 +146,66 @@ class EmailHandler:
         # OAuth 2.0 settings
         self.oauth_creds = None
         self.gmail_service = None
+        self._http = None  # shared AuthorizedHttp; keepalive across API calls
+        # Short-lived access tokens are cached on disk so re-instantiation
+        # skips the service-account JSON parse and token round-trip.
+        self.token_cache_file = ".gmail_token_cache.json"
+        self.token_min_remaining = 300  # seconds of validity required to reuse
         
-        # Storage for email messages
-        self.emails_file = "emails.json"
+        # Storage for email messages: SQLite (WAL) holds one row per email,
+        # so a change writes ~1 KB instead of rewriting the whole store.
+        # Older stores (emails.jsonl / emails.json) are migrated on first run.
+        self.emails_db_file = "emails.db"
+        self.legacy_jsonl_file = "emails.jsonl"
+        self.legacy_emails_file = "emails.json"
         self.emails: Dict[str, EmailMessage] = {}
+        # Secondary indexes kept in lockstep with self.emails so user and
+        # thread lookups don't scan the whole mailbox.
+        self._by_user: Dict[int, set] = {}        # meshtastic id -> email ids
+        self._children: Dict[str, set] = {}       # reply_to_id -> child email ids
+        # (recipient, normalized subject) -> outgoing email id, so incoming
+        # replies resolve in one lookup instead of scanning the mailbox.
+        self._outgoing_index: Dict[Tuple[str, str], str] = {}
+        # Path-compression cache for _find_root_email_id: every id maps to
+        # the root of its thread once resolved.
+        self._root_cache: Dict[str, str] = {}
+        # The monitor thread and main thread both touch self.emails and the
+        # store; RLock because locked paths call other locked helpers.
+        self._lock = threading.RLock()
+        self._db = self._open_emails_db()
         self._load_emails()
+        # Monotonic counter behind _generate_short_id; new ids never collide
+        # with each other, only legacy random ids need stepping past.
+        self._id_counter = len(self.emails)
         
         # Initialize authentication
         self._setup_authentication()
-        
+
+        # Outgoing mail goes through a background worker: send_email just
+        # enqueues, so Meshtastic packet handling never waits on SMTP/HTTP.
+        self.send_max_retries = 3
+        self.send_retry_delay = 2.0  # doubles per attempt
+        # One long-lived SMTP connection amortizes TCP + STARTTLS + AUTH
+        # (~4 RTTs) across sends; SMTP is not multiplexed, so the lock
+        # serializes concurrent senders onto it.
+        self._smtp = None
+        self._smtp_lock = threading.Lock()
+        self._send_queue = queue.Queue()
+        self._sender_thread = threading.Thread(target=self._sender_loop, daemon=True)
+        self._sender_thread.start()
+
         # Start monitoring thread for incoming emails
         self.monitoring = False
         self.monitor_thread = None
+        self._imap_conn = None  # persistent IMAP connection for IDLE
+        self.idle_renew_seconds = 1680  # re-issue IDLE under the 29-min RFC 2177 cap
+        # UID checkpoint: only mail above this UID is ever fetched, so polls
+        # cost headers-only bandwidth and nothing is reprocessed. None means
+        # no checkpoint yet; it is seeded at the mailbox's current end on the
+        # first connection so history is never replayed. UIDVALIDITY rides
+        # along so a rebuilt mailbox invalidates the stale UIDs.
+        self.uid_state_file = ".imap_uid_state.json"
+        self._last_uid, self._uidvalidity = self._load_uid_state()
         self.start_monitoring()
     
     def _setup_authentication(self):
@@ -114,6 +223,49 @@ class EmailHandler:
         else:
             raise ValueError(f"Unsupported auth method: {self.auth_method}")
     
+    def _token_cache_key(self) -> str:
+        return hashlib.sha256(self.gmail_email.encode('utf-8')).hexdigest()
+
+    def _load_cached_token(self) -> Optional[Tuple[str, float]]:
+        """Return (access token, expiry timestamp) with enough validity left, or None."""
+        try:
+            if not os.path.exists(self.token_cache_file):
+                return None
+            with open(self.token_cache_file, 'r', encoding='utf-8') as f:
+                cache = json.load(f)
+            if cache.get('key') != self._token_cache_key():
+                return None
+            expiry = cache.get('expiry', 0)
+            if expiry - time.time() < self.token_min_remaining:
+                return None
+            token = cache.get('token')
+            return (token, expiry) if token else None
+        except Exception as e:
+            logger.debug(f"Token cache read failed: {e}")
+            return None
+
+    def _store_cached_token(self, creds):
+        """Persist the current access token and its expiry for reuse."""
+        try:
+            token = getattr(creds, 'token', None)
+            expiry = getattr(creds, 'expiry', None)
+            if not token or expiry is None:
+                return
+            with open(self.token_cache_file, 'w', encoding='utf-8') as f:
+                json.dump({
+                    'key': self._token_cache_key(),
+                    'token': token,
+                    'expiry': expiry.timestamp(),
+                }, f)
+        except Exception as e:
+            logger.debug(f"Token cache write failed: {e}")
+
+    def _build_gmail_service(self):
+        """Build the Gmail client on one shared keepalive HTTP connection."""
+        self._http = google_auth_httplib2.AuthorizedHttp(self.oauth_creds, http=httplib2.Http())
+        return build('gmail', 'v1', http=self._http,
+                     cache_discovery=True, static_discovery=True)
+
     def _setup_oauth2_service_account(self):
         """Setup OAuth 2.0 authentication using service account."""
         try:
@@ -136,10 +288,23 @@ class EmailHandler:
             # For domain-wide delegation, impersonate the user
             if hasattr(self.oauth_creds, 'with_subject'):
                 self.oauth_creds = self.oauth_creds.with_subject(self.gmail_email)
-            
-            # Build Gmail service
-            self.gmail_service = build('gmail', 'v1', credentials=self.oauth_creds)
-            
+
+            # Seed a still-valid cached access token onto the signer so the
+            # first API call skips the token round-trip. The credentials keep
+            # their private key, so unlike a bare Credentials(token=...) they
+            # can refresh themselves once the seeded token expires.
+            cached = self._load_cached_token()
+            if cached:
+                token, expiry_ts = cached
+                self.oauth_creds.token = token
+                self.oauth_creds.expiry = datetime.fromtimestamp(
+                    expiry_ts, tz=timezone.utc).replace(tzinfo=None)
+                logger.info("Seeded OAuth 2.0 access token from cache")
+
+            # Build Gmail service (static discovery avoids the discovery-doc fetch)
+            self.gmail_service = self._build_gmail_service()
+            self._store_cached_token(self.oauth_creds)
+
             logger.info("OAuth 2.0 service account authentication setup successful")
             
         except Exception as e:
@@ -172,9 +337,10 @@ class EmailHandler:
                 with open(self.auth_credentials, 'w') as token:
                     token.write(self.oauth_creds.to_json())
             
-            # Build Gmail service
-            self.gmail_service = build('gmail', 'v1', credentials=self.oauth_creds)
-            
+            # Build Gmail service (static discovery avoids the discovery-doc fetch)
+            self.gmail_service = self._build_gmail_service()
+            self._store_cached_token(self.oauth_creds)
+
             logger.info("OAuth 2.0 user consent authentication setup successful")
             
         except Exception as e:
@@ -250,34 +416,131 @@ class EmailHandler:
             logger.error(f"App password IMAP connection failed: {e}")
             raise
     
+    def _open_emails_db(self):
+        """Open (and create if needed) the SQLite email store."""
+        db = sqlite3.connect(self.emails_db_file, check_same_thread=False)
+        # WAL: writers append to the log instead of rewriting pages in place,
+        # and the monitor thread's reads never block a write.
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute(
+            'CREATE TABLE IF NOT EXISTS emails ('
+            '  unique_id TEXT PRIMARY KEY,'
+            '  timestamp REAL,'
+            '  data BLOB,'
+            '  body TEXT'
+            ')'
+        )
+        db.commit()
+        return db
+
     def _load_emails(self):
-        """Load emails from persistent storage."""
+        """Load emails from persistent storage, migrating legacy formats."""
         try:
-            if os.path.exists(self.emails_file):
-                with open(self.emails_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    for email_id, email_data in data.items():
-                        # Handle migration for existing emails without message_id
-                        if 'message_id' not in email_data:
-                            email_data['message_id'] = f"<{email_id}@meshtastic.local>"
-                        self.emails[email_id] = EmailMessage(**email_data)
-                logger.info(f"Loaded {len(self.emails)} emails from storage")
+            for (blob,) in self._db.execute('SELECT data FROM emails'):
+                email_data = self._decode_email(blob)
+                self.emails[email_data['unique_id']] = EmailMessage(**email_data)
+
+            if not self.emails:
+                migrated = self._load_legacy_emails()
+                if migrated:
+                    self._upsert_emails(self.emails.values())
+
+            for email_msg in self.emails.values():
+                self._index_email(email_msg)
+            logger.info(f"Loaded {len(self.emails)} emails from storage")
         except Exception as e:
             logger.warning(f"Could not load emails: {e}")
+
+    def _load_legacy_emails(self) -> bool:
+        """One-time migration from the old JSONL / whole-file JSON stores."""
+        if os.path.exists(self.legacy_jsonl_file):
+            with open(self.legacy_jsonl_file, 'rb') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    email_data = self._decode_email(line)
+                    if 'message_id' not in email_data:
+                        email_data['message_id'] = f"<{email_data['unique_id']}@meshtastic.local>"
+                    # Last write wins: later lines supersede earlier ones
+                    self.emails[email_data['unique_id']] = EmailMessage(**email_data)
+            return True
+        if os.path.exists(self.legacy_emails_file):
+            with open(self.legacy_emails_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+                for email_id, email_data in data.items():
+                    if 'message_id' not in email_data:
+                        email_data['message_id'] = f"<{email_id}@meshtastic.local>"
+                    self.emails[email_id] = EmailMessage(**email_data)
+            return True
+        return False
     
-    def _save_emails(self):
-        """Save emails to persistent storage."""
+    def _index_email(self, email_msg: EmailMessage):
+        """Add an email to the per-user and parent->children indexes."""
+        self._by_user.setdefault(email_msg.sender_meshtastic_id, set()).add(email_msg.unique_id)
+        if email_msg.reply_to_id:
+            self._children.setdefault(email_msg.reply_to_id, set()).add(email_msg.unique_id)
+        if email_msg.direction == 'outgoing':
+            # First outgoing mail per (recipient, subject) wins, matching the
+            # old scan's insertion-order behavior.
+            key = (email_msg.recipient_email, _normalize_subject(email_msg.subject))
+            self._outgoing_index.setdefault(key, email_msg.unique_id)
+
+    def _reindex_user(self, email_msg: EmailMessage, old_user_id: int):
+        """Move an email between per-user index buckets after reassignment."""
+        bucket = self._by_user.get(old_user_id)
+        if bucket is not None:
+            bucket.discard(email_msg.unique_id)
+            if not bucket:
+                del self._by_user[old_user_id]
+        self._by_user.setdefault(email_msg.sender_meshtastic_id, set()).add(email_msg.unique_id)
+
+    @staticmethod
+    def _encode_email(email_msg: EmailMessage) -> bytes:
+        """Serialize one email record to compact JSON bytes."""
+        # EmailMessage is a flat slotted dataclass of JSON-native fields, so a
+        # shallow dict over its slots avoids asdict's recursive copy.
+        record = {f: getattr(email_msg, f) for f in EmailMessage.__slots__}
+        # Bodies live in their own column and are hydrated on demand, so the
+        # metadata blob that gets loaded for every email stays small.
+        record['body'] = None
+        if HAVE_ORJSON:
+            return orjson.dumps(record)
+        return json.dumps(record, separators=(',', ':')).encode('utf-8')
+
+    @staticmethod
+    def _decode_email(line) -> dict:
+        return orjson.loads(line) if HAVE_ORJSON else json.loads(line)
+
+    def _upsert_email(self, email_msg: EmailMessage):
+        """Persist one email row (insert or overwrite)."""
+        self._upsert_emails((email_msg,))
+
+    def _upsert_emails(self, email_msgs):
+        """Persist several email rows in a single transaction."""
         try:
-            with open(self.emails_file, 'w', encoding='utf-8') as f:
-                data = {email_id: asdict(email_msg) for email_id, email_msg in self.emails.items()}
-                json.dump(data, f, indent=2)
+            with self._lock:
+                # COALESCE keeps the stored body when re-persisting an
+                # unhydrated (body=None) message, e.g. a reassignment after
+                # restart.
+                self._db.executemany(
+                    'INSERT INTO emails (unique_id, timestamp, data, body)'
+                    ' VALUES (?, ?, ?, ?)'
+                    ' ON CONFLICT(unique_id) DO UPDATE SET'
+                    '  timestamp=excluded.timestamp,'
+                    '  data=excluded.data,'
+                    '  body=COALESCE(excluded.body, emails.body)',
+                    [(m.unique_id, m.timestamp, self._encode_email(m), m.body)
+                     for m in email_msgs]
+                )
+                self._db.commit()
         except Exception as e:
             logger.warning(f"Could not save emails: {e}")
     
-    def send_email(self, sender_meshtastic_id: int, sender_email: str, 
-                   recipient_email: str, subject: str, body: str, 
+    def send_email(self, sender_meshtastic_id: int, sender_email: str,
+                   recipient_email: str, subject: str, body: str,
                    reply_to_id: Optional[str] = None) -> Tuple[bool, str]:
-        """Send an email via SMTP and store it."""
+        """Queue an email for sending and store it. Returns immediately."""
         try:
             # Create unique ID for this email
             unique_id = self._generate_short_id()
@@ -333,17 +596,7 @@ class EmailHandler:
             full_body = body + footer
             
             msg.attach(MIMEText(full_body, 'plain', 'utf-8'))
-            
-            # Send via appropriate method
-            gmail_message_id = None
-            if self.auth_method in ["oauth2_service_account", "oauth2_user_consent"]:
-                # Use Gmail API for OAuth2
-                gmail_message_id = self._send_via_gmail_api(msg)
-            else:
-                # Use SMTP for app password
-                with self._get_smtp_connection() as server:
-                    server.send_message(msg)
-            
+
             # Store the email with our generated Message-ID for proper threading
             # Even though Gmail generates internal IDs, we'll use our format for threading
             final_message_id = message_id
@@ -357,35 +610,101 @@ class EmailHandler:
                 timestamp=time.time(),
                 direction='outgoing',
                 reply_to_id=reply_to_id,  # CRITICAL: Set reply_to_id for threading
-                message_id=final_message_id  # Use our generated Message-ID for threading
+                message_id=final_message_id,  # Use our generated Message-ID for threading
+                status='pending'
             )
-            self.emails[unique_id] = email_msg
-            self._save_emails()
-            
-            logger.info(f"Email sent successfully with ID: {unique_id}")
+            with self._lock:
+                self.emails[unique_id] = email_msg
+                self._index_email(email_msg)
+                self._upsert_email(email_msg)
+
+            # Actual delivery happens on the sender worker; the caller only
+            # pays for the enqueue.
+            self._send_queue.put((msg, email_msg))
+
+            logger.info(f"Email queued for sending with ID: {unique_id}")
             if reply_to_id:
                 logger.info(f"  Stored with reply_to_id: {reply_to_id} for threading")
             else:
                 logger.info(f"  Stored as new email (no threading)")
             return True, unique_id
-            
+
         except Exception as e:
-            logger.error(f"Failed to send email: {e}")
+            logger.error(f"Failed to queue email: {e}")
             return False, str(e)
+
+    def _ensure_smtp(self):
+        """Return a live authenticated SMTP connection, reconnecting if stale."""
+        if self._smtp is not None:
+            try:
+                if self._smtp.noop()[0] == 250:
+                    return self._smtp
+            except Exception:
+                pass
+            try:
+                self._smtp.close()
+            except Exception:
+                pass
+            self._smtp = None
+        self._smtp = self._get_app_password_smtp_connection()
+        return self._smtp
+
+    def _send_via_smtp(self, msg):
+        """Send over the persistent SMTP connection, retrying once on drop."""
+        with self._smtp_lock:
+            try:
+                self._ensure_smtp().send_message(msg)
+            except (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError):
+                self._smtp = None
+                self._ensure_smtp().send_message(msg)
+
+    def _sender_loop(self):
+        """Worker thread: deliver queued emails with retry and backoff."""
+        while True:
+            msg, email_msg = self._send_queue.get()
+            delay = self.send_retry_delay
+            for attempt in range(1, self.send_max_retries + 1):
+                try:
+                    if self.auth_method in ["oauth2_service_account", "oauth2_user_consent"]:
+                        self._send_via_gmail_api(msg)
+                    else:
+                        self._send_via_smtp(msg)
+                    email_msg.status = 'sent'
+                    logger.info(f"Email sent successfully with ID: {email_msg.unique_id}")
+                    break
+                except Exception as e:
+                    logger.error(f"Send attempt {attempt} for email {email_msg.unique_id} failed: {e}")
+                    if attempt < self.send_max_retries:
+                        time.sleep(delay)
+                        delay *= 2
+            else:
+                email_msg.status = 'failed'
+                logger.error(f"Giving up on email {email_msg.unique_id} after {self.send_max_retries} attempts")
+            with self._lock:
+                self._upsert_email(email_msg)
+            self._send_queue.task_done()
     
+    # Base32 alphabet (RFC 4648) for short email ids
+    _ID_ALPHABET = string.ascii_uppercase + '234567'
+
+    @classmethod
+    def _encode_short_id(cls, n: int) -> str:
+        chars = []
+        while n:
+            chars.append(cls._ID_ALPHABET[n % 32])
+            n //= 32
+        return ''.join(reversed(chars)).rjust(5, 'A')
+
     def _generate_short_id(self) -> str:
-        """Generate a short, memorable email ID."""
-        # Format: 2 letters + 3 digits (e.g., AB123, XY789)
-        letters = ''.join(random.choices(string.ascii_uppercase, k=2))
-        digits = ''.join(random.choices(string.digits, k=3))
-        short_id = f"{letters}{digits}"
-        
-        # Ensure uniqueness
+        """Generate a short, collision-free email ID."""
+        # Deterministic counter encoded as 5-char base32 — sortable, one
+        # increment per id instead of random draws with birthday-paradox
+        # retries. The membership check only ever skips legacy random ids.
+        self._id_counter += 1
+        short_id = self._encode_short_id(self._id_counter)
         while short_id in self.emails:
-            letters = ''.join(random.choices(string.ascii_uppercase, k=2))
-            digits = ''.join(random.choices(string.digits, k=3))
-            short_id = f"{letters}{digits}"
-        
+            self._id_counter += 1
+            short_id = self._encode_short_id(self._id_counter)
         return short_id
 
     def _send_via_gmail_api(self, msg):
@@ -394,8 +713,12 @@ class EmailHandler:
             if not self.gmail_service:
                 raise ValueError("Gmail service not initialized")
             
-            # Convert MIME message to raw email format
-            raw_message = base64.urlsafe_b64encode(msg.as_bytes()).decode('utf-8')
+            # Flatten the MIME message straight into a buffer and encode its
+            # memoryview — avoids the extra full copy msg.as_bytes() makes.
+            # The decode to str is required by the JSON request body.
+            buf = io.BytesIO()
+            BytesGenerator(buf, policy=policy.SMTP).flatten(msg)
+            raw_message = base64.urlsafe_b64encode(buf.getbuffer()).decode('ascii')
             
             # Send via Gmail API
             message = self.gmail_service.users().messages().send(
@@ -412,56 +735,83 @@ class EmailHandler:
         except Exception as e:
             logger.error(f"Failed to send email via Gmail API: {e}")
             raise
+    def _hydrate_body(self, email_msg: EmailMessage) -> EmailMessage:
+        """Fill in a lazily-loaded body from the store on first access."""
+        if email_msg.body is None:
+            row = self._db.execute(
+                'SELECT body FROM emails WHERE unique_id = ?',
+                (email_msg.unique_id,)
+            ).fetchone()
+            email_msg.body = row[0] if row and row[0] is not None else ''
+        return email_msg
+
     def get_email(self, unique_id: str) -> Optional[EmailMessage]:
         """Retrieve an email by its unique ID."""
-        return self.emails.get(unique_id)
-    
+        email_msg = self.emails.get(unique_id)
+        return self._hydrate_body(email_msg) if email_msg else None
+
     def get_emails_for_user(self, meshtastic_user_id: int) -> List[EmailMessage]:
         """Get all emails for a specific Meshtastic user."""
-        return [email_msg for email_msg in self.emails.values() 
-                if email_msg.sender_meshtastic_id == meshtastic_user_id]
-    
+        with self._lock:
+            return [self._hydrate_body(self.emails[uid])
+                    for uid in self._by_user.get(meshtastic_user_id, ())]
+
     def get_email_thread(self, email_id: str) -> List[EmailMessage]:
         """Get the complete email thread for a given email ID."""
-        thread = []
-        current_id = email_id
-        
-        # First, find the root email (the one with no reply_to_id)
-        while current_id and current_id in self.emails:
-            email = self.emails[current_id]
-            thread.insert(0, email)  # Insert at beginning to maintain order
-            current_id = email.reply_to_id
-        
-        # Then find all emails that reply to this thread
-        # Use a set to avoid duplicates
-        thread_ids = {e.unique_id for e in thread}
-        for email in self.emails.values():
-            if email.reply_to_id in thread_ids and email.unique_id not in thread_ids:
-                thread.append(email)
-                thread_ids.add(email.unique_id)
-        
-        return sorted(thread, key=lambda x: x.timestamp)
+        with self._lock:
+            if email_id not in self.emails:
+                return []
+
+            # Walk down from the root via the children index — O(thread size)
+            # instead of scanning the whole mailbox.
+            root_id = self._find_root_email_id(email_id)
+            thread = []
+            seen = set()
+            stack = [root_id or email_id]
+            while stack:
+                current_id = stack.pop()
+                if current_id in seen or current_id not in self.emails:
+                    continue
+                seen.add(current_id)
+                thread.append(self.emails[current_id])
+                stack.extend(self._children.get(current_id, ()))
+
+        return sorted((self._hydrate_body(m) for m in thread), key=lambda x: x.timestamp)
     
     def _find_root_email_id(self, email_id: str) -> Optional[str]:
         """Find the root email ID in a conversation chain."""
+        cached = self._root_cache.get(email_id)
+        if cached is not None:
+            return cached
+
         current_id = email_id
         visited = set()  # Prevent infinite loops
-        
+        chain = []
+        root_id = email_id  # Fallback when no root is reachable
+
         # Trace back through the reply chain to find the root email
         while current_id and current_id in self.emails and current_id not in visited:
             visited.add(current_id)
+            chain.append(current_id)
             email = self.emails[current_id]
-            
+
             if not email.reply_to_id:
                 # This is the root email (no reply_to_id)
-                logger.info(f"Found root email: {current_id} (subject: {email.subject})")
-                return current_id
-            
+                root_id = current_id
+                break
+
+            # A parent with a known root resolves the whole chain
+            cached = self._root_cache.get(email.reply_to_id)
+            if cached is not None:
+                root_id = cached
+                break
+
             current_id = email.reply_to_id
-        
-        # If we can't find a root, return the original email_id
-        logger.info(f"Could not find root email, returning original: {email_id}")
-        return email_id
+
+        # Path compression: every visited id now points straight at the root
+        for visited_id in chain:
+            self._root_cache[visited_id] = root_id
+        return root_id
     
     def debug_email_threading(self, email_id: str) -> str:
         """Debug email threading by showing the Message-ID chain."""
@@ -482,15 +832,26 @@ class EmailHandler:
         """Start monitoring for incoming emails."""
         if self.monitoring:
             return
-        
+
         self.monitoring = True
-        self.monitor_thread = threading.Thread(target=self._monitor_inbox, daemon=True)
+        if AIOIMAP_AVAILABLE and self.auth_method == "app_password":
+            # Dedicated event-loop thread: IMAP waits yield the loop instead
+            # of parking a thread inside synchronous ssl reads. uvloop, when
+            # installed, backs the loop with libuv for lower wake-up latency.
+            if HAVE_UVLOOP:
+                target = lambda: uvloop.run(self._monitor_inbox_async())
+            else:
+                target = lambda: asyncio.run(self._monitor_inbox_async())
+        else:
+            target = self._monitor_inbox
+        self.monitor_thread = threading.Thread(target=target, daemon=True)
         self.monitor_thread.start()
         logger.info("Started email monitoring thread")
     
     def stop_monitoring(self):
         """Stop monitoring for incoming emails."""
         self.monitoring = False
+        self._drop_imap_connection()  # unblocks a thread parked in IDLE
         if self.monitor_thread:
             self.monitor_thread.join()
         logger.info("Stopped email monitoring")
@@ -501,82 +862,331 @@ class EmailHandler:
             try:
                 if self.auth_method in ["oauth2_service_account", "oauth2_user_consent"]:
                     self._check_inbox_oauth2()
+                    time.sleep(30)  # Gmail API path still polls
                 else:
+                    # IMAP path: process any backlog, then block in IDLE until
+                    # the server pushes activity (no 30s poll, no reconnects).
                     self._check_inbox_imap()
-                time.sleep(30)  # Check every 30 seconds
+                    self._idle_until_activity()
             except Exception as e:
                 logger.error(f"Error in inbox monitoring: {e}")
+                self._drop_imap_connection()
                 time.sleep(60)  # Wait longer on error
+
+    async def _monitor_inbox_async(self):
+        """asyncio IMAP monitor: same IDLE flow, but waits yield the loop."""
+        imap = None
+        while self.monitoring:
+            try:
+                if imap is None:
+                    imap = aioimaplib.IMAP4_SSL(host=self.imap_server, port=self.imap_port)
+                    await imap.wait_hello_from_server()
+                    await imap.login(self.gmail_email, self.auth_credentials)
+                    select_resp = await imap.select('INBOX')
+                    # Same checkpoint as the sync poller: verify UIDVALIDITY
+                    # and seed on first run, so the two paths never diverge
+                    # or replay each other's mail.
+                    self._sync_checkpoint(*self._parse_select_state(select_resp.lines))
+
+                # Drain mail above the shared UID checkpoint
+                resp = await imap.uid('search', f'{self._last_uid + 1}:*')
+                raw_uids = resp.lines[0].split() if resp.lines else []
+                uids = sorted(u for u in (int(x) for x in raw_uids) if u > self._last_uid)
+                for uid in uids:
+                    try:
+                        fetch_resp = await imap.uid('fetch', str(uid), '(RFC822)')
+                        raw = next((l for l in fetch_resp.lines if isinstance(l, (bytes, bytearray)) and b'\r\n' in l), None)
+                        if raw is not None:
+                            email_message = email.message_from_bytes(raw)
+                            if self._is_meshtastic_reply(email_message):
+                                self._process_incoming_reply(email_message)
+                        self._last_uid = uid
+                    except Exception as e:
+                        logger.error(f"Error processing email UID {uid}: {e}")
+                if uids:
+                    self._save_uid_state()
+
+                # Park in IDLE until the server pushes or the renew cap hits
+                idle_task = await imap.idle_start(timeout=self.idle_renew_seconds)
+                await imap.wait_server_push()
+                imap.idle_done()
+                await asyncio.wait_for(idle_task, timeout=10)
+            except Exception as e:
+                logger.error(f"Error in async inbox monitoring: {e}")
+                if imap is not None:
+                    try:
+                        await imap.logout()
+                    except Exception:
+                        pass
+                    imap = None
+                await asyncio.sleep(60)
+
+    def _get_idle_imap(self):
+        """Return the persistent IMAP connection, creating it if needed."""
+        if self._imap_conn is None:
+            imap = self._get_imap_connection()
+            imap.select('INBOX')
+            self._imap_conn = imap
+        return self._imap_conn
+
+    def _drop_imap_connection(self):
+        """Tear down the persistent IMAP connection after an error."""
+        conn, self._imap_conn = self._imap_conn, None
+        if conn is not None:
+            try:
+                conn.logout()
+            except Exception:
+                pass
+
+    def _idle_until_activity(self) -> bool:
+        """
+        Hold the connection in IMAP IDLE (RFC 2177) until the server pushes
+        EXISTS/RECENT or the renew interval passes. Returns True if activity
+        was seen.
+        """
+        imap = self._get_idle_imap()
+        tag = imap._new_tag()
+        imap.send(tag + b' IDLE' + imaplib.CRLF)
+        if not imap.readline().startswith(b'+'):
+            raise imaplib.IMAP4.error("Server refused IDLE")
+
+        saw_activity = False
+        imap.sock.settimeout(self.idle_renew_seconds)
+        try:
+            line = imap.readline()
+            if b'EXISTS' in line or b'RECENT' in line:
+                saw_activity = True
+        except OSError:
+            pass  # renew interval elapsed without server push
+        finally:
+            imap.sock.settimeout(None)
+
+        imap.send(b'DONE' + imaplib.CRLF)
+        while True:
+            line = imap.readline()
+            if not line or line.startswith(tag):
+                break
+        return saw_activity
     
     def _check_inbox_oauth2(self):
         """Check Gmail inbox using OAuth 2.0 and Gmail API."""
         try:
             if not self.gmail_service:
                 return
-            
-            # Get unread messages
+
+            # Get unread message ids only
             results = self.gmail_service.users().messages().list(
-                userId='me', labelIds=['UNREAD']
+                userId='me', labelIds=['UNREAD'], fields='messages/id,nextPageToken'
             ).execute()
-            
+
             messages = results.get('messages', [])
-            logger.info(f"Found {len(messages)} unread messages in Gmail inbox")
-            
+            if not messages:
+                return
+            logger.debug("Found %d unread messages in Gmail inbox", len(messages))
+
+            # Fetch all messages in one batched HTTP request instead of one
+            # round-trip per message.
+            fetched: Dict[str, dict] = {}
+
+            def _collect(request_id, response, exception):
+                if exception is not None:
+                    logger.error(f"Error fetching message {request_id}: {exception}")
+                else:
+                    fetched[request_id] = response
+
+            # Metadata-only fetch: the reply decision reads headers, so don't
+            # pull base64 bodies for mail we may never process.
+            batch = self.gmail_service.new_batch_http_request(callback=_collect)
             for message in messages:
+                batch.add(
+                    self.gmail_service.users().messages().get(
+                        userId='me', id=message['id'],
+                        format='metadata',
+                        metadataHeaders=[
+                            'From', 'To', 'Subject', 'In-Reply-To', 'References',
+                            'Message-ID', 'X-Meshtastic-Email-ID', 'X-Meshtastic-Sender-ID'
+                        ],
+                        fields='id,threadId,labelIds,payload/headers',
+                    ),
+                    request_id=message['id'],
+                )
+            batch.execute()
+
+            processed_ids = []
+            for msg_id, msg in fetched.items():
                 try:
-                    # Get full message details
-                    msg = self.gmail_service.users().messages().get(
-                        userId='me', id=message['id']
-                    ).execute()
-                    
-                    logger.info(f"Processing message {message['id']}")
-                    
-                    # Check if this is a reply to a Meshtastic email
+                    # Check if this is a reply to a Meshtastic email; only then
+                    # pay for the full body download. Lazy %s formatting: no
+                    # string work at all unless debug logging is on.
                     if self._is_meshtastic_reply_api(msg):
-                        logger.info(f"Message {message['id']} identified as Meshtastic reply")
-                        self._process_incoming_reply_api(msg)
+                        logger.debug("Message %s identified as Meshtastic reply", msg_id)
+                        full_msg = self.gmail_service.users().messages().get(
+                            userId='me', id=msg_id, format='full'
+                        ).execute()
+                        self._process_incoming_reply_api(full_msg)
                     else:
-                        logger.info(f"Message {message['id']} not identified as Meshtastic reply")
-                    
-                    # Mark as read
-                    self.gmail_service.users().messages().modify(
-                        userId='me', id=message['id'],
-                        body={'removeLabelIds': ['UNREAD']}
-                    ).execute()
-                    
+                        logger.debug("Message %s not identified as Meshtastic reply", msg_id)
+                    processed_ids.append(msg_id)
                 except Exception as e:
-                    logger.error(f"Error processing message {message['id']}: {e}")
-                    
+                    logger.error(f"Error processing message {msg_id}: {e}")
+
+            # Second batch: clear UNREAD on everything we processed
+            if processed_ids:
+                mark_batch = self.gmail_service.new_batch_http_request()
+                for msg_id in processed_ids:
+                    mark_batch.add(
+                        self.gmail_service.users().messages().modify(
+                            userId='me', id=msg_id,
+                            body={'removeLabelIds': ['UNREAD']}
+                        )
+                    )
+                mark_batch.execute()
+
         except Exception as e:
             logger.error(f"Error checking inbox via OAuth 2.0: {e}")
     
+    def _load_uid_state(self):
+        """Return (last_uid, uidvalidity); (None, None) when no checkpoint exists."""
+        try:
+            if os.path.exists(self.uid_state_file):
+                with open(self.uid_state_file, 'r', encoding='utf-8') as f:
+                    state = json.load(f)
+                last_uid = state.get('last_uid')
+                if last_uid is not None:
+                    uidvalidity = state.get('uidvalidity')
+                    return int(last_uid), (int(uidvalidity) if uidvalidity is not None else None)
+        except Exception as e:
+            logger.warning(f"Could not load IMAP UID state: {e}")
+        return None, None
+
+    def _save_uid_state(self):
+        try:
+            with open(self.uid_state_file, 'w', encoding='utf-8') as f:
+                json.dump({'last_uid': self._last_uid, 'uidvalidity': self._uidvalidity}, f)
+        except Exception as e:
+            logger.warning(f"Could not save IMAP UID state: {e}")
+
+    def _sync_checkpoint(self, uidvalidity: Optional[int], max_uid: int):
+        """Validate the checkpoint against the selected mailbox.
+
+        A changed UIDVALIDITY means the mailbox was rebuilt and every stored
+        UID is meaningless, so the checkpoint is discarded. A missing (or
+        just-discarded) checkpoint is seeded at the mailbox's current end:
+        old mail was either handled before the state file vanished or
+        predates the bot, and must not be relayed to mesh users again.
+        """
+        if uidvalidity is not None:
+            if self._uidvalidity is not None and uidvalidity != self._uidvalidity:
+                logger.warning(
+                    f"IMAP UIDVALIDITY changed ({self._uidvalidity} -> {uidvalidity}); resetting UID checkpoint"
+                )
+                self._last_uid = None
+            self._uidvalidity = uidvalidity
+        if self._last_uid is None:
+            self._last_uid = max_uid
+            self._save_uid_state()
+            logger.info(f"Seeded IMAP UID checkpoint at {max_uid}")
+
+    @staticmethod
+    def _first_literal(msg_data) -> Optional[bytes]:
+        """Pull the first message literal out of an IMAP FETCH response."""
+        for part in msg_data or []:
+            if isinstance(part, tuple) and len(part) > 1 and isinstance(part[1], (bytes, bytearray)):
+                return part[1]
+        return None
+
+    _FETCH_UID_RE = re.compile(rb'UID (\d+)')
+    _UIDVALIDITY_RE = re.compile(rb'UIDVALIDITY (\d+)')
+    _UIDNEXT_RE = re.compile(rb'UIDNEXT (\d+)')
+
+    @staticmethod
+    def _response_int(imap, key: str) -> Optional[int]:
+        """Read a numeric untagged response (UIDVALIDITY/UIDNEXT) recorded by SELECT."""
+        try:
+            _, data = imap.response(key)
+            if data and data[0]:
+                return int(data[0])
+        except Exception:
+            pass
+        return None
+
+    @classmethod
+    def _parse_select_state(cls, lines) -> Tuple[Optional[int], int]:
+        """Extract (uidvalidity, max_uid) from raw SELECT response lines."""
+        blob = b' '.join(
+            l if isinstance(l, (bytes, bytearray)) else str(l).encode() for l in lines or []
+        )
+        uv = cls._UIDVALIDITY_RE.search(blob)
+        un = cls._UIDNEXT_RE.search(blob)
+        return (int(uv.group(1)) if uv else None), (int(un.group(1)) - 1 if un else 0)
+
+    @staticmethod
+    def _coalesce_uids(uids: List[int]) -> str:
+        """Collapse sorted ids into an IMAP sequence set: [4,5,6,8] -> '4:6,8'."""
+        parts = []
+        i = 0
+        while i < len(uids):
+            j = i
+            while j + 1 < len(uids) and uids[j + 1] == uids[j] + 1:
+                j += 1
+            parts.append(str(uids[i]) if i == j else f'{uids[i]}:{uids[j]}')
+            i = j + 1
+        return ','.join(parts)
+
     def _check_inbox_imap(self):
-        """Check Gmail inbox using IMAP."""
+        """Process new mail (above the UID checkpoint) on the persistent connection."""
+        imap = self._get_idle_imap()
+
+        uidnext = self._response_int(imap, 'UIDNEXT')
+        self._sync_checkpoint(self._response_int(imap, 'UIDVALIDITY'),
+                              (uidnext - 1) if uidnext else 0)
+
+        # UID SEARCH from the checkpoint: stable across polls and restarts,
+        # unlike UNSEEN which rescans anything not yet flagged.
+        _, data = imap.uid('SEARCH', None, f'{self._last_uid + 1}:*')
+        uids = [int(u) for u in data[0].split()] if data and data[0] else []
+        uids = sorted(u for u in uids if u > self._last_uid)
+        if not uids:
+            return
+
+        # One header FETCH for the whole batch: contiguous uids collapse to
+        # a:b runs, so dozens of new messages cost one round-trip instead of
+        # one each. BODY.PEEK keeps flags untouched; headers (~1 KB) are all
+        # the reply decision needs.
+        headers_by_uid: Dict[int, bytes] = {}
         try:
-            with self._get_imap_connection() as imap:
-                imap.select('INBOX')
-                
-                # Search for unread emails
-                _, message_numbers = imap.search(None, 'UNSEEN')
-                
-                for num in message_numbers[0].split():
-                    try:
-                        _, msg_data = imap.fetch(num, '(RFC822)')
-                        email_body = msg_data[0][1]
-                        email_message = email.message_from_bytes(email_body)
-                        
-                        # Check if this is a reply to a Meshtastic email
-                        if self._is_meshtastic_reply(email_message):
-                            self._process_incoming_reply(email_message)
-                        
-                        # Mark as read
-                        imap.store(num, '+FLAGS', '\\Seen')
-                        
-                    except Exception as e:
-                        logger.error(f"Error processing email {num}: {e}")
-                
+            _, msg_data = imap.uid('FETCH', self._coalesce_uids(uids), '(UID BODY.PEEK[HEADER])')
+            for part in msg_data or []:
+                if isinstance(part, tuple) and len(part) > 1 and isinstance(part[1], (bytes, bytearray)):
+                    m = self._FETCH_UID_RE.search(part[0])
+                    if m:
+                        headers_by_uid[int(m.group(1))] = part[1]
         except Exception as e:
-            logger.error(f"Error checking inbox via IMAP: {e}")
+            # Bail without touching the checkpoint: advancing _last_uid past
+            # UIDs whose headers were never examined would silently drop that
+            # mail. The next poll retries the whole window.
+            logger.error(f"Batched header fetch failed: {e}")
+            return
+
+        for uid in uids:
+            try:
+                header_bytes = headers_by_uid.get(uid)
+                if header_bytes is not None:
+                    header_msg = email.message_from_bytes(header_bytes)
+
+                    # Only replies pay for the full body download
+                    if self._is_meshtastic_reply(header_msg):
+                        _, full_data = imap.uid('FETCH', str(uid), '(BODY.PEEK[])')
+                        full_bytes = self._first_literal(full_data)
+                        if full_bytes is not None:
+                            self._process_incoming_reply(email.message_from_bytes(full_bytes))
+
+                self._last_uid = uid
+            except Exception as e:
+                logger.error(f"Error processing email UID {uid}: {e}")
+
+        if uids:
+            self._save_uid_state()
     
     def _is_meshtastic_reply(self, email_message) -> bool:
         """Check if an email is a reply to a Meshtastic email (IMAP)."""
@@ -590,62 +1200,53 @@ class EmailHandler:
         
         return False
     
+    # Subject/sender fragments that mark system mail (delivery reports etc.).
+    # One compiled alternation per header: a single C-level scan replaces a
+    # Python substring probe per token, and the lists can grow for free.
+    _SUBJ_DENY = re.compile(
+        r'delivery|bounce|failure|notification|security|verification'
+        r'|welcome|setup|account|google|gmail|no-?reply', re.I)
+    _FROM_DENY = re.compile(r'no-?reply|mailer-daemon|postmaster|google|gmail', re.I)
+
+    # The only header names any decision path reads; the rest of a typical
+    # 30-60 entry Gmail header list is skipped instead of copied into the map.
+    _WANTED_HEADERS = frozenset((
+        'from', 'to', 'subject', 'message-id',
+        'x-meshtastic-email-id', 'in-reply-to', 'references',
+    ))
+
+    @classmethod
+    def _header_map(cls, headers) -> Dict[str, str]:
+        """Fold a Gmail API header list into a case-insensitive dict.
+
+        Names are lowercased so From/FROM/from all hit; the first occurrence
+        of a repeated header wins. One pass here buys O(1) lookups after.
+        """
+        hdrs: Dict[str, str] = {}
+        wanted = cls._WANTED_HEADERS
+        for h in headers:
+            name = h['name'].lower()
+            if name in wanted and name not in hdrs:
+                hdrs[name] = h['value']
+        return hdrs
+
     def _is_meshtastic_reply_api(self, message_data) -> bool:
         """Check if an email is a reply to a Meshtastic email (Gmail API)."""
-        headers = message_data.get('payload', {}).get('headers', [])
-        
-        logger.info(f"Checking if message is Meshtastic reply. Found {len(headers)} headers")
-        
-        # Check for Meshtastic-specific headers (most reliable)
-        for header in headers:
-            if header['name'] == 'X-Meshtastic-Email-ID':
-                logger.info(f"Found X-Meshtastic-Email-ID header: {header['value']}")
-                return True
-        
-        # Check if it's a reply to any email (has In-Reply-To header)
-        for header in headers:
-            if header['name'] == 'In-Reply-To':
-                logger.info(f"Found In-Reply-To header: {header['value']}")
-                return True
-        
-        # Check if it's a reply to any email (has References header)
-        for header in headers:
-            if header['name'] == 'References':
-                logger.info(f"Found References header: {header['value']}")
-                return True
-        
-        # Only consider it a reply if it's sent to our bot AND has a subject that suggests it's a reply
-        # This filters out system emails, delivery notifications, etc.
-        to_header = None
-        subject_header = None
-        from_header = None
-        
-        for header in headers:
-            if header['name'] == 'To':
-                to_header = header['value']
-            elif header['name'] == 'Subject':
-                subject_header = header['value']
-            elif header['name'] == 'From':
-                from_header = header['value']
-        
-        # Must be sent to our bot AND have a subject that suggests it's a user reply
-        # AND not be from a system email address
-        logger.info(f"Fallback check - To: {to_header}, Subject: {subject_header}, From: {from_header}")
-        
-        if (to_header == self.gmail_email and 
-            subject_header and 
-            from_header and
-            not any(system_indicator in subject_header.lower() for system_indicator in [
-                'delivery', 'bounce', 'failure', 'notification', 'security', 'verification',
-                'welcome', 'setup', 'account', 'google', 'gmail', 'no-reply', 'noreply'
-            ]) and
-            not any(system_indicator in from_header.lower() for system_indicator in [
-                'no-reply', 'noreply', 'mailer-daemon', 'postmaster', 'google', 'gmail'
-            ])):
-            logger.info("Message passed fallback checks - treating as Meshtastic reply")
+        hdrs = self._header_map(message_data.get('payload', {}).get('headers', []))
+
+        # Meshtastic-specific header or any reply-threading header is enough
+        if 'x-meshtastic-email-id' in hdrs or 'in-reply-to' in hdrs or 'references' in hdrs:
             return True
-        
-        logger.info("Message failed fallback checks - not a Meshtastic reply")
+
+        # Fallback: must be sent to our bot AND not look like system mail
+        # (delivery notifications, account mail, etc.)
+        to_header = hdrs.get('to')
+        subject_header = hdrs.get('subject')
+        from_header = hdrs.get('from')
+        if to_header == self.gmail_email and subject_header and from_header:
+            if not self._SUBJ_DENY.search(subject_header) and not self._FROM_DENY.search(from_header):
+                return True
+
         return False
     
     def _process_incoming_reply(self, email_message):
@@ -686,132 +1287,149 @@ class EmailHandler:
         except Exception as e:
             logger.error(f"Error processing incoming reply: {e}")
     
+    def _match_by_subject(self, sender_email: str, subject: str) -> Optional[str]:
+        """Resolve a reply to an outgoing email id by its subject.
+
+        Exact hit on the (recipient, normalized subject) index first — O(1)
+        and covers the common "Re: <our subject>" client behavior — then a
+        fuzzy/containment scan over outgoing mail to this sender.
+        """
+        if not subject:
+            return None
+        clean_reply_subject = _normalize_subject(subject)
+
+        with self._lock:
+            match_id = self._outgoing_index.get((sender_email, clean_reply_subject))
+        if match_id:
+            logger.debug("Matched reply via outgoing index to email %s", match_id)
+            return match_id
+
+        # Miss: fuzzy-match against outgoing mail to this sender.
+        # .values() only: the key always equals unique_id, so the
+        # per-candidate (k, v) tuple from .items() is pure waste.
+        with self._lock:
+            candidates = {
+                email_msg.unique_id: _normalize_subject(email_msg.subject)
+                for email_msg in self.emails.values()
+                if (email_msg.direction == 'outgoing' and
+                    email_msg.recipient_email == sender_email)
+            }
+        if HAVE_RAPIDFUZZ and candidates:
+            match = rf_process.extractOne(
+                clean_reply_subject, candidates,
+                scorer=fuzz.token_set_ratio, score_cutoff=85)
+            if match:
+                logger.debug("Fuzzy-matched reply to email %s (score %.0f)",
+                             match[2], match[1])
+                return match[2]
+        else:
+            # Containment scan when rapidfuzz is not installed
+            for email_id, clean_original_subject in candidates.items():
+                if (clean_reply_subject == clean_original_subject or
+                        clean_original_subject in clean_reply_subject):
+                    logger.debug("Matched reply by subject similarity to email %s", email_id)
+                    return email_id
+        return None
+
     def _process_incoming_reply_api(self, message_data):
         """Process an incoming reply email (Gmail API)."""
         try:
             headers = message_data.get('payload', {}).get('headers', [])
-            sender_email = ""
-            subject = ""
-            
-            # Extract headers
-            for header in headers:
-                if header['name'] == 'From':
-                    sender_email = header['value']
-                    # Extract clean email address from "Display Name <email@domain.com>" format
-                    if '<' in sender_email and '>' in sender_email:
-                        sender_email = sender_email.split('<')[1].split('>')[0]
-                elif header['name'] == 'Subject':
-                    subject = header['value']
-            
-            # Extract body
-            body = self._extract_body_from_gmail_api(message_data)
-            
-            # Extract Gmail Message-ID for proper threading
-            gmail_message_id = None
-            for header in headers:
-                if header['name'] == 'Message-ID':
-                    gmail_message_id = header['value']
-                    break
-            
-            # Log all headers for debugging
-            logger.info(f"Processing email from {sender_email} with subject: {subject}")
-            logger.info("All headers found:")
-            for header in headers:
-                logger.info(f"  {header['name']}: {header['value']}")
-            
-            # Try to find the original Meshtastic email ID
-            original_email_id = None
-            
-            # First check for Meshtastic-specific header
-            for header in headers:
-                if header['name'] == 'X-Meshtastic-Email-ID':
-                    original_email_id = header['value']
-                    logger.info(f"Found X-Meshtastic-Email-ID: {original_email_id}")
-                    break
-            
-            # If not found, check In-Reply-To header
-            if not original_email_id:
-                for header in headers:
-                    if header['name'] == 'In-Reply-To':
-                        # Extract the message ID from In-Reply-To
-                        message_id = header['value']
-                        logger.info(f"Found In-Reply-To: {message_id}")
-                        # Gmail message IDs are not useful for finding our emails
-                        # Skip this and try subject matching instead
-                        logger.info("In-Reply-To contains Gmail message ID, will try subject matching")
-                        break
-            
-            # If still not found, check References header
-            if not original_email_id:
-                for header in headers:
-                    if header['name'] == 'References':
-                        # Extract the first message ID from References
-                        references = header['value']
-                        if references:
-                            message_id = references.split()[0]  # First reference
-                            logger.info(f"Found References: {message_id}")
-                            # Gmail message IDs are not useful for finding our emails
-                            # Skip this and try subject matching instead
-                            logger.info("References contains Gmail message ID, will try subject matching")
-                        break
-            
-            # If still not found, try to match by subject (for replies that don't preserve headers)
-            if not original_email_id and subject:
-                logger.info(f"Trying to match by subject: '{subject}'")
-                # Look for emails with similar subjects (common in email clients)
-                for email_id, email_msg in self.emails.items():
-                    if email_msg.direction == 'outgoing':
-                        logger.info(f"Checking outgoing email {email_id}: subject='{email_msg.subject}', recipient='{email_msg.recipient_email}'")
-                        
-                        # Check if this is a reply to our email
-                        logger.info(f"Comparing: recipient='{email_msg.recipient_email}' vs sender='{sender_email}'")
-                        logger.info(f"Comparing: subject='{email_msg.subject}' vs reply_subject='{subject}'")
-                        
-                        # Check if this is a reply to our email
-                        # Remove "Re:" prefix and compare subjects
-                        clean_reply_subject = subject.lower().replace('re:', '').strip()
-                        clean_original_subject = email_msg.subject.lower()
-                        
-                        if (email_msg.recipient_email == sender_email and
-                            (clean_reply_subject == clean_original_subject or
-                             clean_original_subject in clean_reply_subject)):
-                            logger.info(f"Matched reply by subject similarity to email {email_id}")
-                            logger.info(f"  Original: '{clean_original_subject}'")
-                            logger.info(f"  Reply: '{clean_reply_subject}'")
-                            original_email_id = email_id
-                            break
-                
-                if not original_email_id:
-                    logger.warning(f"Subject matching failed - no outgoing email found for {sender_email} with subject similar to '{subject}'")
-            
-            if not original_email_id:
+
+            # Case-insensitive header map: one pass over the list, then O(1)
+            # lookups for every field the reply flow needs.
+            hdrs = self._header_map(headers)
+            debug_on = logger.isEnabledFor(logging.DEBUG)
+            # Extract clean email address from "Display Name <email@domain.com>"
+            # format: one anchored C-level scan, no intermediate split lists,
+            # and malformed headers fall back to the stripped raw value.
+            from_value = hdrs.get('from', '')
+            m = _ADDR_RE.search(from_value)
+            sender_email = m.group(1) if m else from_value.strip()
+            subject = hdrs.get('subject', '')
+            gmail_message_id = hdrs.get('message-id')
+
+            # Full header dump only when debug logging is actually on, and as
+            # one record rather than one handler dispatch per header
+            if debug_on:
+                logger.debug("Processing email from %s with subject: %s\nHeaders:\n%s",
+                             sender_email, subject,
+                             '\n'.join(f"  {h['name']}: {h['value']}" for h in headers))
+
+            # Priority chain: our own tracking header wins outright, then the
+            # subject index / fuzzy matcher. Each step runs only if the one
+            # before it missed.
+            # In-Reply-To / References carry Gmail message ids that never map
+            # to our short ids, so they are not consulted at all.
+            original_email_id = (hdrs.get('x-meshtastic-email-id') or
+                                 self._match_by_subject(sender_email, subject))
+
+            # Decode the body only once the mail maps to an outgoing email:
+            # unrelated mail is stored header-only (it is never relayed), so
+            # it skips the base64 + UTF-8 decode of potentially large parts.
+            if original_email_id:
+                body = self._extract_body_from_gmail_api(message_data)
+            else:
                 logger.warning("No reply headers found - this might not be a reply to a Meshtastic email")
-            
+                body = ""
+
             self._store_incoming_reply(sender_email, subject, body, original_email_id, gmail_message_id)
-            
+
         except Exception as e:
             logger.error(f"Error processing incoming reply via API: {e}")
     
+    # Crude tag stripper for the text/html fallback body
+    _TAG_RE = re.compile(r'<[^>]+>')
+
+    @staticmethod
+    def _decode_b64_text(data) -> str:
+        """Decode a Gmail API url-safe base64 body part to text."""
+        # Straight to binascii: one translate with the module-level table and
+        # one C-level decode, skipping urlsafe_b64decode's per-call table
+        # build. Gmail often strips padding, so restore exactly what the
+        # length requires up front rather than letting the decoder raise.
+        if isinstance(data, str):
+            data = data.encode('ascii')
+        data = data.translate(_B64_TRANS) + b'=' * ((-len(data)) % 4)
+        return binascii.a2b_base64(data).decode('utf-8', errors='ignore')
+
     def _extract_body_from_gmail_api(self, message_data):
-        """Extract email body from Gmail API message data."""
+        """Extract email body from Gmail API message data (memoized)."""
+        # Memo on the message dict itself: if the same payload is revisited
+        # the base64 + UTF-8 decode happens once.
+        cached = message_data.get('_decoded_body')
+        if cached is None:
+            cached = message_data['_decoded_body'] = self._extract_body_uncached(message_data)
+        return cached
+
+    def _extract_body_uncached(self, message_data):
         try:
-            payload = message_data.get('payload', {})
-            
-            if 'parts' in payload:
-                # Multipart message
-                for part in payload['parts']:
-                    if part.get('mimeType') == 'text/plain':
-                        data = part.get('body', {}).get('data', '')
-                        if data:
-                            import base64
-                            return base64.urlsafe_b64decode(data).decode('utf-8', errors='ignore')
-            else:
-                # Simple message
-                data = payload.get('body', {}).get('data', '')
+            # Breadth-first walk of the MIME tree: Gmail replies commonly
+            # nest multipart/alternative inside multipart/mixed, which a
+            # top-level-only scan misses entirely.
+            parts = deque([message_data.get('payload', {})])
+            html_data = None
+            other_data = None
+            while parts:
+                part = parts.popleft()
+                data = part.get('body', {}).get('data', '')
                 if data:
-                    import base64
-                    return base64.urlsafe_b64decode(data).decode('utf-8', errors='ignore')
-            
+                    mime = part.get('mimeType', '')
+                    if mime == 'text/plain':
+                        return self._decode_b64_text(data)
+                    if mime == 'text/html':
+                        if html_data is None:
+                            html_data = data
+                    elif other_data is None:
+                        other_data = data
+                parts.extend(part.get('parts', ()))
+
+            # No text/plain anywhere: fall back to stripped HTML, then to
+            # whatever single-part data the message carried.
+            if html_data is not None:
+                return self._TAG_RE.sub('', self._decode_b64_text(html_data))
+            if other_data is not None:
+                return self._decode_b64_text(other_data)
             return ""
         except Exception as e:
             logger.error(f"Error extracting body from Gmail API: {e}")
@@ -836,50 +1454,86 @@ class EmailHandler:
                 reply_to_id=original_email_id,
                 message_id=gmail_message_id or f"<{unique_id}@meshtastic.local>"
             )
-            self.emails[unique_id] = email_msg
-            self._save_emails()
-            
-            logger.info(f"Processed incoming reply email with ID: {unique_id}")
+            with self._lock:
+                self.emails[unique_id] = email_msg
+                self._index_email(email_msg)
+                self._upsert_email(email_msg)
+
+            logger.info("Processed incoming reply email with ID: %s", unique_id)
             
         except Exception as e:
             logger.error(f"Error storing incoming reply: {e}")
     
     def get_pending_replies(self) -> List[EmailMessage]:
         """Get all incoming emails that need to be relayed back to Meshtastic users."""
-        # Filter out system emails and only return actual user replies
-        valid_replies = []
-        for email_msg in self.emails.values():
-            if (email_msg.direction == 'incoming' and 
-                email_msg.sender_meshtastic_id == 0 and
-                email_msg.reply_to_id):
-                valid_replies.append(email_msg)
-        
-        # If we find replies without valid reply_to_id, mark them as processed to clean them up
-        for email_msg in self.emails.values():
-            if (email_msg.direction == 'incoming' and 
-                email_msg.sender_meshtastic_id == 0 and
-                not email_msg.reply_to_id):
-                logger.info(f"Marking system email {email_msg.unique_id} as processed (not a valid reply)")
-                email_msg.sender_meshtastic_id = -1  # Mark as processed but invalid
-                self._save_emails()
-        
-        return valid_replies
+        with self._lock:
+            # One pass: unclaimed incoming mail either is a valid user reply
+            # (has a reply_to_id) or gets reclassified as processed system
+            # mail on the spot.
+            valid_replies = []
+            marked = []
+            for email_msg in list(self.emails.values()):
+                if (email_msg.direction != 'incoming' or
+                        email_msg.sender_meshtastic_id != 0):
+                    continue
+                if email_msg.reply_to_id:
+                    valid_replies.append(email_msg)
+                else:
+                    logger.info("Marking system email %s as processed (not a valid reply)", email_msg.unique_id)
+                    email_msg.sender_meshtastic_id = -1  # Mark as processed but invalid
+                    self._reindex_user(email_msg, 0)
+                    marked.append(email_msg)
+            if marked:
+                # One write for the whole batch of "-1" marks
+                self._upsert_emails(marked)
+
+            return [self._hydrate_body(m) for m in valid_replies]
     
     def mark_reply_processed(self, email_id: str, meshtastic_user_id: int):
         """Mark a reply as processed and associate it with a Meshtastic user."""
-        if email_id in self.emails:
-            self.emails[email_id].sender_meshtastic_id = meshtastic_user_id
-            self._save_emails()
+        with self._lock:
+            if email_id in self.emails:
+                email_msg = self.emails[email_id]
+                old_user_id = email_msg.sender_meshtastic_id
+                email_msg.sender_meshtastic_id = meshtastic_user_id
+                self._reindex_user(email_msg, old_user_id)
+                self._upsert_email(email_msg)
     
     def cleanup_old_emails(self, max_age_days: int = 30):
         """Clean up old emails to prevent storage bloat."""
         cutoff_time = time.time() - (max_age_days * 24 * 3600)
-        old_emails = [email_id for email_id, email_msg in self.emails.items() 
-                     if email_msg.timestamp < cutoff_time]
-        
-        for email_id in old_emails:
+        with self._lock:
+            self._cleanup_old_emails_locked(cutoff_time)
+
+    def _cleanup_old_emails_locked(self, cutoff_time: float):
+        # Single scan: prune and unindex in the same pass instead of building
+        # an expired-id list first and re-probing the dict per deletion.
+        removed = 0
+        for email_id, email_msg in list(self.emails.items()):
+            if email_msg.timestamp >= cutoff_time:
+                continue
             del self.emails[email_id]
+            removed += 1
+            bucket = self._by_user.get(email_msg.sender_meshtastic_id)
+            if bucket is not None:
+                bucket.discard(email_id)
+                if not bucket:
+                    del self._by_user[email_msg.sender_meshtastic_id]
+            if email_msg.reply_to_id:
+                children = self._children.get(email_msg.reply_to_id)
+                if children is not None:
+                    children.discard(email_id)
+                    if not children:
+                        del self._children[email_msg.reply_to_id]
+            self._children.pop(email_id, None)
         
-        if old_emails:
-            self._save_emails()
-            logger.info(f"Cleaned up {len(old_emails)} old emails")
+        if removed:
+            self._root_cache.clear()  # compressed paths may point at deleted mail
+            self._outgoing_index = {k: v for k, v in self._outgoing_index.items()
+                                    if v in self.emails}
+            try:
+                self._db.execute('DELETE FROM emails WHERE timestamp < ?', (cutoff_time,))
+                self._db.commit()
+            except Exception as e:
+                logger.warning(f"Could not delete old emails from store: {e}")
+            logger.info(f"Cleaned up {removed} old emails")
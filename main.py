@@ -7,15 +7,38 @@ All AI and weather flows happen in DM with the bot.
 """
 
 import asyncio
+import atexit
+import concurrent.futures
+import functools
 import json
 import logging
+import logging.handlers
+import mmap
 import os
+import queue
+import re
+import socket
 import time
 import threading
-from typing import Optional, Set, Dict
+from typing import Optional, Dict
 from dotenv import load_dotenv
 import paho.mqtt.client as mqtt
 
+# orjson is optional; it serializes 5-10x faster than stdlib json
+try:
+    import orjson
+    HAVE_ORJSON = True
+except ImportError:
+    HAVE_ORJSON = False
+
+# pyroaring is optional; a roaring bitmap of 32-bit node numbers is far
+# smaller than a set of strings once the sender list grows.
+try:
+    import pyroaring
+    HAVE_PYROARING = True
+except ImportError:
+    HAVE_PYROARING = False
+
 from protobuf_parser import ProtobufParser
 from session_manager import SessionManager
 from ai_handler import AIHandler
@@ -31,11 +54,118 @@ logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s - %(levelname)s - %(message)s"
 )
-logger = logging.getLogger(__name__)
 
-KNOWN_SENDERS_FILE = os.getenv("KNOWN_SENDERS_FILE", "known_senders.json")
+# Route all records through a queue so formatting/flushing happens on a
+# background listener thread instead of the message/reply hot paths.
+_log_queue: "queue.Queue" = queue.Queue(-1)
+_root_logger = logging.getLogger()
+_log_listener = logging.handlers.QueueListener(
+    _log_queue, *_root_logger.handlers, respect_handler_level=True
+)
+_root_logger.handlers = [logging.handlers.QueueHandler(_log_queue)]
+_log_listener.start()
 
+logger = logging.getLogger(__name__)
 
+KNOWN_SENDERS_FILE = os.getenv("KNOWN_SENDERS_FILE", "known_senders.json")  # legacy, migrated on load
+KNOWN_SENDERS_LOG = os.getenv("KNOWN_SENDERS_LOG", "known_senders.log")
+
+# Compiled once at import: lines to drop from incoming email bodies (quoted
+# text and typical reply headers) and the bot footer that ends the content.
+_EMAIL_STRIP_RE = re.compile(
+    r"^(?:\s*>.*"
+    r"|(?:from|sent|to|subject|date|message-id|in-reply-to|references):.*"
+    r"|on .*"
+    r"|.* wrote:.*)$\n?",
+    re.I | re.M,
+)
+_EMAIL_FOOTER_RE = re.compile(
+    r"this message was forwarded from a bot on the meshtastic network", re.I
+)
+_BLANK_LINES_RE = re.compile(r"\n\s*\n+")
+
+# Static DM text, frozen once at import instead of rebuilt per send.
+HELP_TEXT = "Commands:\n" + "\n".join([
+    "/ai <question> — ask the AI (context-aware).",
+    "/weather — try GPS, then ask for a typed location.",
+    "/weather <lat,lon> — override with coordinates.",
+    "/weather <City[, Country]> — override with place name.",
+    "/weather clear — forget cached location.",
+    "/email <email> <subject> — send an email.",
+    "/email get <id> — view email details.",
+    "/email thread <id> — view complete email conversation.",
+    "/email reply <id> — reply to an email (subject auto-generated).",
+    "/email debug <id> — debug email threading information.",
+    "/bot — brief intro and tips.",
+])
+EMAIL_SYNTAX_MSG = ("Email syntax: /email <recipient_email> <subject>\n"
+                    "Example: /email user@example.com Hello there")
+REPLY_SYNTAX_MSG = ("Reply syntax: /email reply <email_id>\n"
+                    "Example: /email reply abc123")
+GPS_REQUEST_MSG = "Requesting your node GPS… If it doesn't arrive in ~20s, I'll ask for a typed location."
+GPS_FALLBACK_MSG = "No GPS received. Please send a location (e.g. 'lat,lon' or 'City, Country')."
+LOCATION_PARSE_FAIL_MSG = "Sorry, I couldn't parse that location. Try 'lat,lon' or 'City, Country'."
+
+
+def _json_dumps(data) -> bytes:
+    """Serialize to bytes (paho accepts bytes payloads directly)."""
+    if HAVE_ORJSON:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(',', ':')).encode('utf-8')
+
+
+def _json_loads(raw):
+    return orjson.loads(raw) if HAVE_ORJSON else json.loads(raw)
+
+
+# Coordinate keys seen across firmware/json variants, in preference order.
+_LAT_KEYS = ("lat", "latitude", "latitudeI")
+_LON_KEYS = ("lon", "lng", "longitude", "longitudeI")
+
+
+def _norm_coord(v) -> Optional[float]:
+    """Normalize a coordinate: integer-scaled (1e-7 degrees) or plain float."""
+    if isinstance(v, (int, float)):
+        return float(v) / 1e7 if abs(v) > 1000 else float(v)
+    return None
+
+
+def _find_coord(d: dict) -> Optional[tuple]:
+    """Pull (lat, lon) out of a parsed json/mqtt position packet, if present."""
+    # Membership tests rather than `or`-chains: 0 (the equator/meridian) is a
+    # legitimate coordinate and must not fall through to the next key.
+    lat = next((d[k] for k in _LAT_KEYS if k in d and d[k] is not None), None)
+    lon = next((d[k] for k in _LON_KEYS if k in d and d[k] is not None), None)
+    if lat is not None and lon is not None:
+        return _norm_coord(lat), _norm_coord(lon)
+    payload = d.get("payload") or {}
+    decoded = payload.get("decoded") if isinstance(payload, dict) else {}
+    for src in (payload, decoded):
+        if isinstance(src, dict):
+            la = next((src[k] for k in _LAT_KEYS if k in src and src[k] is not None), None)
+            lo = next((src[k] for k in _LON_KEYS if k in src and src[k] is not None), None)
+            if la is not None and lo is not None:
+                return _norm_coord(la), _norm_coord(lo)
+    return None
+
+
+@functools.lru_cache(maxsize=256)
+def _topic_tail_nodeid(topic: str) -> Optional[str]:
+    """Find the trailing '!hex' gateway segment of an MQTT topic.
+
+    Memoized: only a handful of gateway topic strings ever occur, so the
+    reverse scan runs once per distinct topic instead of per message.
+    """
+    end = len(topic)
+    while end > 0:
+        start = topic.rfind('/', 0, end) + 1
+        if start < end and topic[start] == '!' and end - start > 1:
+            return topic[start:end]
+        end = start - 1
+    return None
+
+
+@functools.lru_cache(maxsize=256)
 def node_hex_to_decimal(hex_with_bang: str) -> Optional[int]:
     try:
         if not hex_with_bang or not hex_with_bang.startswith('!'):
@@ -62,6 +192,9 @@ class MeshtasticAIBot:
         self.default_region = os.getenv("DEFAULT_REGION", "EU")
         self.default_version = os.getenv("DEFAULT_VERSION", "2")
         self.default_channel_index = int(os.getenv("DEFAULT_CHANNEL_INDEX", 0))  # fallback
+        # Region/version are fixed for the process, so build the downlink
+        # topic once instead of formatting it on every publish.
+        self._json_downlink_topic = f"msh/{self.default_region}/{self.default_version}/json/mqtt/"
 
         # AI
         self.ai_backend = os.getenv("AI_BACKEND", "gemini")
@@ -74,8 +207,10 @@ class MeshtasticAIBot:
 
         # State
         self.mqtt_client: Optional[mqtt.Client] = None
-        self.known_senders: Set[str] = set()
+        # Node numbers as ints; roaring bitmap when available, plain set otherwise
+        self.known_senders = pyroaring.BitMap() if HAVE_PYROARING else set()
         self.gateway_channel_index: Dict[str, int] = {}
+        self._active_gateway: Optional[str] = None  # first gateway we hear from
 
         # components
         self.protobuf_parser = ProtobufParser()
@@ -125,95 +260,217 @@ class MeshtasticAIBot:
         self.response_chunker = ResponseChunker(self.chunk_bytes)
         self._load_known_senders()
 
+        # /email subcommand dispatch: name -> (handler, usage when no args)
+        self._email_subcommands = {
+            "get": (self._handle_email_get, "Please provide an email ID: /email get <email_id>"),
+            "thread": (self._handle_email_thread, "Please provide an email ID: /email thread <email_id>"),
+            "debug": (self._handle_email_debug, "Please provide an email ID: /email debug <email_id>"),
+            "reply": (self._handle_email_reply, "Please provide email ID: /email reply <email_id>"),
+        }
+
+        # Top-level command dispatch for _on_message, keyed by first token.
+        # Private handlers share the (gateway_hex, sender_num, args) shape.
+        self._public_dispatch = {
+            "/bot": self._handle_public_bot,
+            "/ai": self._handle_public_bot,
+            "/weather": self._handle_public_weather,
+            "/help": self._handle_public_help,
+            "/email": self._handle_public_email,
+        }
+        self._private_dispatch = {
+            "/bot": lambda gw, num, args: self._handle_private_bot(gw, num),
+            "/help": lambda gw, num, args: self._send_help(gw, num),
+            "/ai": self._handle_private_ai,
+            "/weather": self._handle_weather_dm,
+            "/email": self._dispatch_email,
+        }
+        # One compiled scan classifies the command and captures its args;
+        # the match groups feed the dispatch dicts above.
+        self._cmd_re = re.compile(
+            r'^(?P<cmd>/bot|/help|/ai|/weather|/email)(?:\s+(?P<args>.*))?$',
+            re.I | re.S,
+        )
+
+        # Downlink publishes queue up here and go out together at the end of
+        # each logical turn (message callback, poll iteration, chunk tick).
+        self._publish_queue = []
+        self._publish_lock = threading.Lock()
+
+        # One shared asyncio loop on a background thread: chunk pacing and
+        # weather timeouts become tasks on this loop instead of spawning a
+        # thread (or a throwaway event loop) per timer.
+        self._loop = asyncio.new_event_loop()
+        self._loop_thread = threading.Thread(target=self._run_loop, daemon=True)
+        self._loop_thread.start()
+        # Set by the reply poller once it starts; lets other threads wake it.
+        self._reply_wake: Optional[asyncio.Event] = None
+
+        # Handlers do real network IO (AI, geocoding, SMTP); a worker pool
+        # keeps that off the paho network thread so the MQTT keepalive never
+        # stalls behind a slow request. Bounded so a stalled downstream
+        # backs up here instead of eating memory.
+        self._work_q: "queue.Queue" = queue.Queue(maxsize=1024)
+        self._channel_lock = threading.Lock()
+        for _ in range(4):
+            threading.Thread(target=self._worker, daemon=True).start()
+        # Side pool for overlapping independent network calls within one
+        # handler (e.g. forecast fetch alongside reverse-geocoding).
+        self._net_pool = concurrent.futures.ThreadPoolExecutor(max_workers=4)
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
     # ---------- persistence of known DM users ----------
 
     def _load_known_senders(self):
         try:
-            if os.path.exists(KNOWN_SENDERS_FILE):
-                with open(KNOWN_SENDERS_FILE, "r", encoding="utf-8") as f:
-                    data = json.load(f)
-                    if isinstance(data, list):
-                        self.known_senders = set(str(x) for x in data)
+            # Append-only log: one sender id per line, duplicates harmless.
+            if os.path.exists(KNOWN_SENDERS_LOG):
+                with open(KNOWN_SENDERS_LOG, "r", encoding="utf-8") as f:
+                    for line in f:
+                        s = line.strip()
+                        if s:
+                            try:
+                                self.known_senders.add(int(s))
+                            except ValueError:
+                                pass
+            # Migrate the legacy JSON file once, then fold it into the log.
+            # Parse straight out of a memory map so the kernel pages it in
+            # lazily instead of read() copying the whole file up front.
+            elif os.path.exists(KNOWN_SENDERS_FILE) and os.path.getsize(KNOWN_SENDERS_FILE):
+                with open(KNOWN_SENDERS_FILE, "rb") as f:
+                    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                    try:
+                        data = _json_loads(memoryview(mm) if HAVE_ORJSON else mm[:])
+                    finally:
+                        mm.close()
+                if isinstance(data, list):
+                    for x in data:
+                        try:
+                            self.known_senders.add(int(x))
+                        except (TypeError, ValueError):
+                            pass
             logger.info(f"Loaded {len(self.known_senders)} known sender(s).")
         except Exception as e:
             logger.warning(f"Could not load known senders file: {e}")
+        try:
+            self._known_senders_log = open(KNOWN_SENDERS_LOG, "a", encoding="utf-8")
+        except Exception as e:
+            logger.warning(f"Could not open known senders log: {e}")
+            self._known_senders_log = None
+        atexit.register(self._compact_known_senders)
 
-    def _save_known_senders(self):
+    def _compact_known_senders(self):
+        """Rewrite the log with one line per unique sender (run at shutdown)."""
         try:
-            with open(KNOWN_SENDERS_FILE, "w", encoding="utf-8") as f:
-                json.dump(sorted(self.known_senders), f)
+            if self._known_senders_log:
+                self._known_senders_log.close()
+                self._known_senders_log = None
+            with open(KNOWN_SENDERS_LOG, "w", encoding="utf-8") as f:
+                f.write("".join(f"{n}\n" for n in sorted(self.known_senders)))
         except Exception as e:
-            logger.warning(f"Could not save known senders file: {e}")
+            logger.warning(f"Could not compact known senders log: {e}")
 
     def _mark_known(self, sender_num: int):
-        s = str(sender_num)
-        if s not in self.known_senders:
-            self.known_senders.add(s)
-            self._save_known_senders()
+        n = int(sender_num)
+        if n not in self.known_senders:
+            self.known_senders.add(n)
+            # O(1) append instead of rewriting the whole file per new sender.
+            if self._known_senders_log:
+                try:
+                    self._known_senders_log.write(f"{n}\n")
+                    self._known_senders_log.flush()
+                except Exception as e:
+                    logger.warning(f"Could not append known sender: {e}")
 
     # ---------- mqtt/json helpers ----------
 
     @staticmethod
-    def _topic_tail_nodeid(topic: str) -> Optional[str]:
-        for token in reversed(topic.split('/')):
-            if token.startswith('!') and len(token) > 1:
-                return token
-        return None
+    def _parse_mesh_json(parsed: dict):
+        """Extract (text, is_public, channel_index) in one traversal.
+
+        Replaces three separate getters that each re-walked the same dicts
+        on every incoming MQTT message.
+        """
+        # type() is checks: exact JSON types only ever come out of the
+        # parser, and they skip isinstance's subclass/MRO machinery.
+        text = None
+        channel = parsed.get("channel")
+        if type(channel) is not int:
+            channel = None
 
-    @staticmethod
-    def _json_extract_text(parsed: dict) -> Optional[str]:
-        if not isinstance(parsed, dict):
-            return None
         payload = parsed.get("payload")
-        if isinstance(payload, dict):
-            if isinstance(payload.get("text"), str):
-                return payload["text"]
-            decoded = payload.get("decoded")
-            if isinstance(decoded, dict) and isinstance(decoded.get("text"), str):
-                return decoded["text"]
-        if isinstance(parsed.get("text"), str):
-            return parsed["text"]
-        return None
+        if type(payload) is dict:
+            t = payload.get("text")
+            if type(t) is str:
+                text = t
+            else:
+                decoded = payload.get("decoded")
+                if type(decoded) is dict:
+                    t = decoded.get("text")
+                    if type(t) is str:
+                        text = t
+            if channel is None:
+                ch = payload.get("channel")
+                if type(ch) is int:
+                    channel = ch
+        if text is None:
+            t = parsed.get("text")
+            if type(t) is str:
+                text = t
 
-    @staticmethod
-    def _json_is_public(parsed: dict) -> bool:
         to_field = parsed.get("to")
-        if to_field is None:
-            return True
-        if isinstance(to_field, str):
-            return to_field.lower() in ("ffffffff", "0xffffffff")
-        if isinstance(to_field, int):
-            return to_field == 0xFFFFFFFF
-        return True
+        if type(to_field) is str:
+            is_public = to_field.lower() in ("ffffffff", "0xffffffff")
+        elif type(to_field) is int:
+            is_public = to_field == 0xFFFFFFFF
+        else:
+            is_public = True
 
-    @staticmethod
-    def _json_extract_channel_index(parsed: dict) -> Optional[int]:
-        try:
-            ch = parsed.get("channel")
-            if isinstance(ch, int):
-                return ch
-            payload = parsed.get("payload")
-            if isinstance(payload, dict):
-                ch2 = payload.get("channel")
-                if isinstance(ch2, int):
-                    return ch2
-        except Exception:
-            pass
-        return None
+        return text, is_public, channel
 
     # ---------- publish to json/mqtt ----------
 
-    def _json_mqtt_topic(self) -> str:
-        return f"msh/{self.default_region}/{self.default_version}/json/mqtt/"
-
     def _publish_json_mqtt(self, data: dict):
-        topic = self._json_mqtt_topic()
-        payload = json.dumps(data)
-        if self.mqtt_client and self.mqtt_client.is_connected():
-            self.mqtt_client.publish(topic, payload)
-            logger.info(f"Published json/mqtt: {topic} -> {payload}")
-        else:
-            logger.warning("MQTT client not connected, cannot publish downlink")
+        with self._publish_lock:
+            self._publish_queue.append(data)
+
+    def _flush_publishes(self):
+        """Publish everything queued during the current logical turn."""
+        with self._publish_lock:
+            if not self._publish_queue:
+                return
+            batch, self._publish_queue = self._publish_queue, []
+        if not (self.mqtt_client and self.mqtt_client.is_connected()):
+            logger.warning(f"MQTT client not connected, dropping {len(batch)} queued downlink(s)")
+            return
+        topic = self._json_downlink_topic
+        # Cork the socket around multi-message batches so the kernel sends
+        # them in one (or few) TCP segments instead of one per publish.
+        corked = len(batch) > 1 and self._set_sockopt(socket.TCP_CORK if hasattr(socket, "TCP_CORK") else None, 1)
+        try:
+            for data in batch:
+                # Entries are dicts, or pre-serialized bytes from the chunk sender.
+                payload = data if isinstance(data, bytes) else _json_dumps(data)
+                self.mqtt_client.publish(topic, payload)
+                logger.info("Published json/mqtt: %s -> %s", topic, payload)
+        finally:
+            if corked:
+                self._set_sockopt(socket.TCP_CORK, 0)
+
+    def _set_sockopt(self, opt, value: int) -> bool:
+        """Best-effort TCP option on paho's underlying socket."""
+        if opt is None:
+            return False
+        try:
+            sock = self.mqtt_client.socket()
+            if sock is None:
+                return False
+            sock.setsockopt(socket.IPPROTO_TCP, opt, value)
+            return True
+        except (OSError, AttributeError, ValueError):
+            return False
 
     def _channel_index_for_gateway(self, gateway_hex: str) -> int:
         return self.gateway_channel_index.get(gateway_hex, self.default_channel_index)
@@ -222,32 +479,18 @@ class MeshtasticAIBot:
         """Clean email body by removing quoted text and email thread content."""
         if not body:
             return ""
-        
-        lines = body.split('\n')
-        clean_lines = []
-        
-        for line in lines:
-            # Skip lines that are typical email reply indicators
-            if any(indicator in line.lower() for indicator in [
-                'on ', ' wrote:', 'from:', 'sent:', 'to:', 'subject:', 
-                'date:', 'message-id:', 'in-reply-to:', 'references:'
-            ]):
-                continue
-            
-            # Skip lines that start with '>' (quoted text)
-            if line.strip().startswith('>'):
-                continue
-                
-            # Stop processing when we hit the bot footer (keep content before it)
-            if 'this message was forwarded from a bot on the meshtastic network' in line.lower():
-                break
-            
-            # Keep the line if it's not empty and not just whitespace
-            if line.strip():
-                clean_lines.append(line)
-        
-        # Join and clean up extra whitespace
-        result = '\n'.join(clean_lines).strip()
+
+        # Cut at the bot footer first (keep content before its line), then
+        # strip quoted/header lines and collapse blank runs in three compiled
+        # regex passes instead of a Python loop over every line.
+        m = _EMAIL_FOOTER_RE.search(body)
+        if m:
+            body_head = body[: body.rfind('\n', 0, m.start()) + 1]
+        else:
+            body_head = body
+
+        result = _EMAIL_STRIP_RE.sub('', body_head)
+        result = _BLANK_LINES_RE.sub('\n', result).strip()
         
         # If we ended up with nothing meaningful, return the original body (truncated)
         if not result or len(result) < 5:
@@ -264,8 +507,9 @@ class MeshtasticAIBot:
         if not original_subject:
             return "Re: Message"
         
-        # Check if subject already starts with "Re: "
-        if original_subject.lower().startswith("re: "):
+        # Check if subject already starts with "Re: " — only casefold the
+        # 4-char prefix instead of lowercasing the whole subject.
+        if original_subject[:4].casefold() == "re: ":
             # Already a reply, don't add another "Re: "
             return original_subject
         else:
@@ -273,14 +517,14 @@ class MeshtasticAIBot:
             return f"Re: {original_subject}"
 
     def _send_dm(self, gateway_hex: str, dest_numeric: int, message: str):
-        logger.info(f"Attempting to send DM via gateway {gateway_hex} to user {dest_numeric}")
+        logger.info("Attempting to send DM via gateway %s to user %s", gateway_hex, dest_numeric)
         gw_dec = node_hex_to_decimal(gateway_hex)
         if gw_dec is None:
             logger.warning(f"Could not derive gateway decimal from {gateway_hex}; skipping DM.")
             return
         
         channel = self._channel_index_for_gateway(gateway_hex)
-        logger.info(f"Gateway {gateway_hex} -> decimal: {gw_dec}, channel: {channel}")
+        logger.info("Gateway %s -> decimal: %s, channel: %s", gateway_hex, gw_dec, channel)
         
         data = {
             "from": gw_dec,
@@ -289,7 +533,7 @@ class MeshtasticAIBot:
             "type": "sendtext",
             "payload": message
         }
-        logger.info(f"Sending DM data: {data}")
+        logger.info("Sending DM data: %s", data)
         self._publish_json_mqtt(data)
 
     def _send_public_nudge(self, gateway_hex: str, text: str):
@@ -322,30 +566,14 @@ class MeshtasticAIBot:
 
     def _send_help(self, gateway_hex: str, user_id: int):
         logger.info(f"Sending help to user {user_id} via gateway {gateway_hex}")
-        help_lines = [
-            "/ai <question> — ask the AI (context-aware).",
-            "/weather — try GPS, then ask for a typed location.",
-            "/weather <lat,lon> — override with coordinates.",
-            "/weather <City[, Country]> — override with place name.",
-            "/weather clear — forget cached location.",
-            "/email <email> <subject> — send an email.",
-            "/email get <id> — view email details.",
-            "/email thread <id> — view complete email conversation.",
-            "/email reply <id> — reply to an email (subject auto-generated).",
-            "/email debug <id> — debug email threading information.",
-            "/bot — brief intro and tips.",
-        ]
-        # Use the exact same logic as weather responses: format string with \n + join
-        help_text = "Commands:\n{}".format("\n".join(help_lines))
-        logger.info(f"Help text prepared: {len(help_text)} characters")
         # Use chunked response for help text (same as AI responses)
-        self._send_chunked_response(gateway_hex, user_id, help_text)
+        self._send_chunked_response(gateway_hex, user_id, HELP_TEXT)
         logger.info(f"Help DM sent to user {user_id}")
 
     # ---------- weather flow (DM only) ----------
 
     def _handle_weather_dm(self, gateway_hex: str, user_id: int, arg_text: str):
-        uid = str(user_id)
+        uid = user_id
         self._mark_known(user_id)
         self.session_manager.create_session(uid)
 
@@ -361,7 +589,7 @@ class MeshtasticAIBot:
         if arg_text:
             loc = self.weather.resolve_location(arg_text)
             if not loc:
-                self._send_dm(gateway_hex, user_id, "Sorry, I couldn't parse that location. Try 'lat,lon' or 'City, Country'.")
+                self._send_dm(gateway_hex, user_id, LOCATION_PARSE_FAIL_MSG)
                 return
             lat, lon, label = loc
             self.session_manager.cache_location(uid, lat, lon, label)
@@ -377,57 +605,39 @@ class MeshtasticAIBot:
             self.session_manager.clear_pending_weather_request(uid)
             return
 
-        # Request GPS and set a reliable 20s fallback using threading.Timer
-        self._send_dm(gateway_hex, user_id, "Requesting your node GPS… If it doesn't arrive in ~20s, I'll ask for a typed location.")
+        # Request GPS and set a reliable 20s fallback on the shared loop
+        self._send_dm(gateway_hex, user_id, GPS_REQUEST_MSG)
         self._request_gps_from_user(gateway_hex, user_id)
         self.session_manager.set_waiting_for_weather_location(uid, True, timeout_sec=20)
 
-        def _fallback():
+        async def _fallback():
+            await asyncio.sleep(20)
             if self.session_manager.has_pending_weather_request(uid):
                 self.session_manager.clear_pending_weather_request(uid)
-                self._send_dm(
-                    gateway_hex, user_id,
-                    "No GPS received. Please send a location (e.g. 'lat,lon' or 'City, Country')."
-                )
+                self._send_dm(gateway_hex, user_id, GPS_FALLBACK_MSG)
+                self._flush_publishes()
 
-        threading.Timer(20.0, _fallback).start()
+        asyncio.run_coroutine_threadsafe(_fallback(), self._loop)
 
-    def _send_weather_reply(self, gateway_hex: str, user_id: int, lat: float, lon: float, label: str):
-        hourly, daily = self.weather.fetch_forecast_lines(lat, lon)
-        msg1 = "Weather for {}\nNext 6 hours:\n{}".format(label, "\n".join(hourly))
-        msg2 = "Next 3 days:\n{}".format("\n".join(daily))
-        self._send_dm(gateway_hex, user_id, msg1)
-        self._send_dm(gateway_hex, user_id, msg2)
+    def _send_weather_reply(self, gateway_hex: str, user_id: int, lat: float, lon: float, label: str,
+                            forecast: Optional[concurrent.futures.Future] = None):
+        # A caller that already knew lat/lon may have started the fetch early.
+        hourly, daily = forecast.result() if forecast is not None else self.weather.fetch_forecast_lines(lat, lon)
+        # One combined message through the chunker: it packs to chunk_bytes,
+        # so this usually means fewer packets than two fixed-boundary DMs.
+        combined = "Weather for {}\nNext 6 hours:\n{}\n\nNext 3 days:\n{}".format(
+            label, "\n".join(hourly), "\n".join(daily))
+        self._send_chunked_response(gateway_hex, user_id, combined)
 
     def _maybe_handle_position_update(self, parsed: dict, gateway_hex: str):
         sender_num = parsed.get("from")
         if sender_num is None:
             return
-        uid = str(sender_num)
+        uid = sender_num
 
         if not self.session_manager.has_pending_weather_request(uid):
             return
 
-        def _norm(v):
-            if isinstance(v, (int, float)):
-                return float(v) / 1e7 if abs(v) > 1000 else float(v)
-            return None
-
-        def _find_coord(d: dict):
-            lat = d.get("lat") or d.get("latitude") or d.get("latitudeI")
-            lon = d.get("lon") or d.get("lng") or d.get("longitude") or d.get("longitudeI")
-            if lat is not None and lon is not None:
-                return _norm(lat), _norm(lon)
-            payload = d.get("payload") or {}
-            decoded = payload.get("decoded") if isinstance(payload, dict) else {}
-            for src in (payload, decoded):
-                if isinstance(src, dict):
-                    la = src.get("lat") or src.get("latitude") or src.get("latitudeI")
-                    lo = src.get("lon") or src.get("lng") or src.get("longitude") or src.get("longitudeI")
-                    if la is not None and lo is not None:
-                        return _norm(la), _norm(lo)
-            return None
-
         coords = _find_coord(parsed)
         if not coords:
             return
@@ -435,16 +645,34 @@ class MeshtasticAIBot:
         if lat is None or lon is None:
             return
 
+        # The forecast and the label both need only lat/lon: fire the
+        # Open-Meteo fetch now and reverse-geocode while it runs, instead of
+        # paying the two round trips back to back.
+        forecast = self._net_pool.submit(self.weather.fetch_forecast_lines, lat, lon)
         label = self.weather.reverse_label(lat, lon) or f"{lat:.4f},{lon:.4f}"
         self.session_manager.cache_location(uid, lat, lon, label)
         self.session_manager.clear_pending_weather_request(uid)
-        self._send_weather_reply(gateway_hex, sender_num, lat, lon, label)
+        self._send_weather_reply(gateway_hex, sender_num, lat, lon, label, forecast=forecast)
 
     # ---------- Email flow (DM only) ----------
 
+    def _dispatch_email(self, gateway_hex: str, sender_num: int, rest: str):
+        """Route '/email ...' to a subcommand handler or the general send flow."""
+        sub, _, args = rest.strip().partition(' ')
+        entry = self._email_subcommands.get(sub.lower())
+        if entry is None:
+            self._handle_private_email(gateway_hex, sender_num, rest.strip())
+            return
+        handler, usage = entry
+        args = args.strip()
+        if args:
+            handler(gateway_hex, sender_num, args)
+        else:
+            self._send_dm(gateway_hex, sender_num, usage)
+
     def _handle_private_email(self, gateway_hex: str, sender_num: int, text: str):
         """Handle /email command in DM."""
-        uid = str(sender_num)
+        uid = sender_num
         self._mark_known(sender_num)
         self.session_manager.create_session(uid)
         
@@ -453,17 +681,13 @@ class MeshtasticAIBot:
         
         # Check if user provided parameters
         if not text.strip():
-            self._send_dm(gateway_hex, sender_num, 
-                         "Email syntax: /email <recipient_email> <subject>\n"
-                         "Example: /email user@example.com Hello there")
+            self._send_dm(gateway_hex, sender_num, EMAIL_SYNTAX_MSG)
             return
         
         # Parse the command - treat everything after the email address as the subject
         text = text.strip()
         if ' ' not in text:
-            self._send_dm(gateway_hex, sender_num, 
-                         "Email syntax: /email <recipient_email> <subject>\n"
-                         "Example: /email user@example.com Hello there")
+            self._send_dm(gateway_hex, sender_num, EMAIL_SYNTAX_MSG)
             return
         
         # Find the first space to separate email from subject
@@ -489,7 +713,7 @@ class MeshtasticAIBot:
 
     def _handle_email_body(self, gateway_hex: str, sender_num: int, body: str):
         """Handle email body input from user."""
-        uid = str(sender_num)
+        uid = sender_num
         
         if not self.session_manager.is_waiting_for_email_body(uid):
             return False
@@ -521,7 +745,7 @@ class MeshtasticAIBot:
 
     def _handle_email_get(self, gateway_hex: str, sender_num: int, email_id: str):
         """Handle /email get command to retrieve email details."""
-        uid = str(sender_num)
+        uid = sender_num
         self._mark_known(sender_num)
         self.session_manager.create_session(uid)
         
@@ -551,7 +775,7 @@ class MeshtasticAIBot:
 
     def _handle_email_thread(self, gateway_hex: str, sender_num: int, email_id: str):
         """Handle /email thread command to show complete email conversation."""
-        uid = str(sender_num)
+        uid = sender_num
         self._mark_known(sender_num)
         self.session_manager.create_session(uid)
         
@@ -589,7 +813,7 @@ class MeshtasticAIBot:
 
     def _handle_email_debug(self, gateway_hex: str, sender_num: int, email_id: str):
         """Handle /email debug command to show email threading information."""
-        uid = str(sender_num)
+        uid = sender_num
         self._mark_known(sender_num)
         self.session_manager.create_session(uid)
         
@@ -609,7 +833,7 @@ class MeshtasticAIBot:
 
     def _handle_email_reply(self, gateway_hex: str, sender_num: int, text: str):
         """Handle /email reply command."""
-        uid = str(sender_num)
+        uid = sender_num
         self._mark_known(sender_num)
         self.session_manager.create_session(uid)
         
@@ -619,9 +843,7 @@ class MeshtasticAIBot:
         # Parse the command - just need email ID
         email_id = text.strip()
         if not email_id:
-            self._send_dm(gateway_hex, sender_num, 
-                         "Reply syntax: /email reply <email_id>\n"
-                         "Example: /email reply abc123")
+            self._send_dm(gateway_hex, sender_num, REPLY_SYNTAX_MSG)
             return
         
         # Get the original email
@@ -657,40 +879,46 @@ class MeshtasticAIBot:
             return
             
         pending_replies = self.email_handler.get_pending_replies()
-        logger.info(f"Checking for pending email replies: found {len(pending_replies)}")
+        logger.info("Checking for pending email replies: found %d", len(pending_replies))
         
+        # Aggregate replies per recipient so each user gets one digest:
+        # one chunking pass and one paced burst instead of a send per reply.
+        digests: Dict[int, list] = {}
+
         for reply in pending_replies:
-            logger.info(f"Processing reply {reply.unique_id} from {reply.sender_email}")
-            
+            logger.info("Processing reply %s from %s", reply.unique_id, reply.sender_email)
+
             # Try to find the original email to determine recipient
             if reply.reply_to_id:
-                logger.info(f"Reply has reply_to_id: {reply.reply_to_id}")
+                logger.info("Reply has reply_to_id: %s", reply.reply_to_id)
                 original_email = self.email_handler.get_email(reply.reply_to_id)
                 if original_email:
-                    logger.info(f"Found original email {reply.reply_to_id}, sending to user {original_email.sender_meshtastic_id}")
-                    # Relay the reply to the original sender using chunked response (same as AI responses)
+                    logger.info("Found original email %s, sending to user %s", reply.reply_to_id, original_email.sender_meshtastic_id)
                     # Clean the email body to remove quoted text and save on Meshtastic traffic
                     clean_body = self._clean_email_body(reply.body)
-                    
+
                     # Format with essential info only (using plain text to avoid encoding issues)
                     reply_message = f"Email Reply Received\nFrom: {reply.sender_email}\nSubject: {reply.subject}\n\n{clean_body}\n\nEmail ID: {reply.unique_id}"
-                    
-                    # Use the same chunked response logic that works for AI responses
-                    self._send_chunked_response(gateway_hex, original_email.sender_meshtastic_id, reply_message)
-                    
+
+                    digests.setdefault(original_email.sender_meshtastic_id, []).append(reply_message)
+
                     # Mark as processed
                     self.email_handler.mark_reply_processed(reply.unique_id, original_email.sender_meshtastic_id)
-                    logger.info(f"Reply {reply.unique_id} forwarded and marked as processed")
+                    logger.info("Reply %s forwarded and marked as processed", reply.unique_id)
                 else:
                     logger.warning(f"Could not find original email with ID: {reply.reply_to_id}")
             else:
                 logger.warning(f"Reply {reply.unique_id} has no reply_to_id, cannot determine recipient")
 
+        # Use the same chunked response logic that works for AI responses
+        for dest, messages in digests.items():
+            self._send_chunked_response(gateway_hex, dest, "\n---\n".join(messages))
+
     # ---------- AI flow (DM only) ----------
 
     def _handle_private_bot(self, gateway_hex: str, sender_num: int):
         self._mark_known(sender_num)
-        self.session_manager.create_session(str(sender_num))
+        self.session_manager.create_session(sender_num)
         self._send_dm(gateway_hex, sender_num, "Hi! I'm your Gemini bot. Use /ai <question>, /weather, or /email commands. (/weather clear for new weather request)")
 
     def _handle_private_ai(self, gateway_hex: str, sender_num: int, text: str):
@@ -698,7 +926,7 @@ class MeshtasticAIBot:
             self._send_dm(gateway_hex, sender_num, "Send /ai followed by your question.")
             return
         self._mark_known(sender_num)
-        self.session_manager.create_session(str(sender_num))
+        self.session_manager.create_session(sender_num)
         try:
             resp = self.ai_handler.chat_respond(str(sender_num), text.strip())
             self._send_chunked_response(gateway_hex, sender_num, resp)
@@ -723,18 +951,42 @@ class MeshtasticAIBot:
 
     def _send_chunked_response(self, gateway_hex: str, dest_numeric: int, response: str):
         chunks = self.response_chunker.chunk_text(response)
+        gw_dec = node_hex_to_decimal(gateway_hex)
+        if gw_dec is None:
+            logger.warning(f"Could not derive gateway decimal from {gateway_hex}; skipping chunked DM.")
+            return
+
+        # Only the payload varies across a burst, so encode the wrapper once
+        # and splice each chunk's JSON-escaped string between the halves.
+        template = _json_dumps({
+            "from": gw_dec,
+            "to": dest_numeric,
+            "channel": self._channel_index_for_gateway(gateway_hex),
+            "type": "sendtext",
+            "payload": "__PAYLOAD__",
+        })
+        pre, _, post = template.partition(b'"__PAYLOAD__"')
+
+        payloads = [pre + _json_dumps(chunk) + post for chunk in chunks]
+
+        # With pacing disabled, queue the whole burst and flush once: the
+        # publishes go out as one corked TCP write instead of N round trips.
+        if self.chunk_delay <= 0:
+            for payload in payloads:
+                self._publish_json_mqtt(payload)
+            self._flush_publishes()
+            return
 
-        async def _send():
-            for i, chunk in enumerate(chunks):
-                self._send_dm(gateway_hex, dest_numeric, chunk)
-                if i < len(chunks) - 1:
-                    await asyncio.sleep(self.chunk_delay)
+        def _send_one(payload: bytes):
+            self._publish_json_mqtt(payload)
+            self._flush_publishes()
 
-        try:
-            loop = asyncio.get_running_loop()
-            loop.create_task(_send())
-        except RuntimeError:
-            asyncio.run(_send())
+        # Enqueue every chunk with its exact deadline up front instead of a
+        # coroutine that re-awakens to sleep between sends; the caller
+        # (paho's network thread or the polling loop) returns immediately.
+        for i, payload in enumerate(payloads):
+            self._loop.call_soon_threadsafe(
+                self._loop.call_later, i * self.chunk_delay, _send_one, payload)
 
     # ---------- MQTT callbacks ----------
 
@@ -744,150 +996,131 @@ class MeshtasticAIBot:
         else:
             logger.error(f"MQTT connection failed with code: {rc}")
             return
+        # Small publishes shouldn't sit in Nagle's buffer waiting for ACKs.
+        self._set_sockopt(socket.TCP_NODELAY, 1)
         client.subscribe(self.root_filter)
         logger.info(f"Subscribed to: {self.root_filter}")
 
     def _on_message(self, client, userdata, msg):
-        try:
-            parsed = None
+        # Runs on the paho network thread: parse cheaply, hand the dispatch
+        # chain to the worker pool, return in microseconds. When the pool
+        # falls behind, drop the oldest queued message rather than blocking
+        # here and starving the MQTT keepalive.
+        # JSON starts with '{' or '['; anything else (e.g. a binary
+        # protobuf envelope) skips the decode-and-fail round trip.
+        parsed = None
+        if msg.payload[:1] in (b"{", b"["):
             try:
-                parsed = json.loads(msg.payload.decode("utf-8"))
+                parsed = _json_loads(msg.payload)
             except Exception:
                 parsed = None
+        else:
+            # Native protobuf envelope: adapt text packets to the json/mqtt
+            # shape so the same dispatch chain serves both wire formats.
+            pkt = self.protobuf_parser.parse_service_envelope(msg.payload)
+            if pkt is not None and self.protobuf_parser.is_text_message(pkt):
+                pkt_text = self.protobuf_parser.extract_text(pkt)
+                if pkt_text:
+                    parsed = {
+                        "from": pkt.from_id,
+                        "to": pkt.to_id,
+                        "payload": {"text": pkt_text},
+                    }
+        if type(parsed) is not dict:
+            return
 
-            if isinstance(parsed, dict):
-                text = self._json_extract_text(parsed)
-                gateway_hex = self._topic_tail_nodeid(msg.topic) or ""
-                sender_num = parsed.get("from")
-                is_public = self._json_is_public(parsed)
-
-                learned_ch = self._json_extract_channel_index(parsed)
-                if learned_ch is not None and gateway_hex:
-                    prev = self.gateway_channel_index.get(gateway_hex)
-                    self.gateway_channel_index[gateway_hex] = learned_ch
-                    if prev != learned_ch:
-                        logger.info(f"Gateway {gateway_hex}: learned channel index {learned_ch}")
-
-                # If GPS position arrives while we are waiting, handle immediately (reply by DM)
-                self._maybe_handle_position_update(parsed, gateway_hex)
-
-                if not text:
-                    return
-
-                low = text.lower().strip()
-                logger.info(f"Processing message: text='{text}', low='{low}', is_public={is_public}, sender_num={sender_num}")
-
-                # PUBLIC: nudge only
-                if is_public and "/bot" in low:
-                    self._handle_public_bot(gateway_hex)
-                    return
-                if is_public and low.startswith("/weather"):
-                    self._handle_public_weather(gateway_hex)
-                    return
-                if is_public and low.startswith("/ai"):
-                    self._handle_public_bot(gateway_hex)
-                    return
-                if is_public and low.startswith("/help"):
-                    self._handle_public_help(gateway_hex)
-                    return
-                if is_public and low.startswith("/email"):
-                    self._handle_public_email(gateway_hex)
-                    return
-
-                # PRIVATE: real work
-                if not is_public and "/bot" in low:
-                    if sender_num is not None:
-                        self._handle_private_bot(gateway_hex, sender_num)
-                    return
-
-                if not is_public and low.startswith("/help"):
-                    logger.info(f"Help command detected in DM from {sender_num}")
-                    if sender_num is not None:
-                        self._send_help(gateway_hex, sender_num)
-                        logger.info(f"Help sent to user {sender_num}")
-                    else:
-                        logger.warning("Help command but no sender_num")
-                    return
-
-                if not is_public and low.startswith("/ai"):
-                    if sender_num is not None:
-                        self._handle_private_ai(gateway_hex, sender_num, text[3:].strip())
-                    return
-
-                if not is_public and low.startswith("/weather"):
-                    if sender_num is not None:
-                        args = text[len("/weather"):].strip()
-                        self._handle_weather_dm(gateway_hex, sender_num, args)
-                    return
-
-                # Check for specific email subcommands FIRST (before the general /email command)
-                if not is_public and low.startswith("/email get"):
-                    if sender_num is not None:
-                        args = text[len("/email get"):].strip()
-                        if args:
-                            self._handle_email_get(gateway_hex, sender_num, args)
-                        else:
-                            self._send_dm(gateway_hex, sender_num, "Please provide an email ID: /email get <email_id>")
-                    return
-
-                if not is_public and low.startswith("/email thread"):
-                    if sender_num is not None:
-                        args = text[len("/email thread"):].strip()
-                        if args:
-                            self._handle_email_thread(gateway_hex, sender_num, args)
-                        else:
-                            self._send_dm(gateway_hex, sender_num, "Please provide an email ID: /email thread <email_id>")
-                    return
-
-                if not is_public and low.startswith("/email debug"):
-                    if sender_num is not None:
-                        args = text[len("/email debug"):].strip()
-                        if args:
-                            self._handle_email_debug(gateway_hex, sender_num, args)
-                        else:
-                            self._send_dm(gateway_hex, sender_num, "Please provide an email ID: /email debug <email_id>")
-                    return
-
-                if not is_public and low.startswith("/email reply"):
-                    if sender_num is not None:
-                        args = text[len("/email reply"):].strip()
-                        if args:
-                            self._handle_email_reply(gateway_hex, sender_num, args)
-                        else:
-                            self._send_dm(gateway_hex, sender_num, "Please provide email ID: /email reply <email_id>")
-                    return
-
-                # General /email command (must come AFTER the specific subcommands)
-                if not is_public and low.startswith("/email"):
-                    if sender_num is not None:
-                        args = text[len("/email"):].strip()
-                        self._handle_private_email(gateway_hex, sender_num, args)
-                    return
-
-                # If we're waiting for a typed location (DM only), treat the next DM message as a location attempt
-                if not is_public and sender_num is not None and self.session_manager.has_pending_weather_request(str(sender_num)):
-                    attempt = text.strip()
-                    loc = self.weather.resolve_location(attempt)
-                    if not loc:
-                        self._send_dm(gateway_hex, sender_num, "Sorry, I couldn't parse that location. Try 'lat,lon' or 'City, Country'.")
-                        return
-                    lat, lon, label = loc
-                    self.session_manager.cache_location(str(sender_num), lat, lon, label)
-                    self.session_manager.clear_pending_weather_request(str(sender_num))
-                    self._send_weather_reply(gateway_hex, sender_num, lat, lon, label)
-                    return
-
-                # If we're waiting for an email body (DM only), treat the next DM message as email body
-                if not is_public and sender_num is not None and self.session_manager.is_waiting_for_email_body(str(sender_num)):
-                    if self._handle_email_body(gateway_hex, sender_num, text.strip()):
-                        return
+        item = (_topic_tail_nodeid(msg.topic) or "", parsed)
+        try:
+            self._work_q.put_nowait(item)
+        except queue.Full:
+            try:
+                self._work_q.get_nowait()
+            except queue.Empty:
+                pass
+            try:
+                self._work_q.put_nowait(item)
+            except queue.Full:
+                logger.warning("Worker queue full; dropping message")
 
-                return
+    def _worker(self):
+        while True:
+            gateway_hex, parsed = self._work_q.get()
+            try:
+                self._process_message(gateway_hex, parsed)
+            except Exception as e:
+                logger.error(f"Error processing message: {e}")
+            finally:
+                self._flush_publishes()
+                self._work_q.task_done()
+
+    def _process_message(self, gateway_hex: str, parsed: dict):
+        text, is_public, learned_ch = self._parse_mesh_json(parsed)
+        sender_num = parsed.get("from")
 
+        if learned_ch is not None and gateway_hex:
+            # Several workers may learn channels concurrently.
+            with self._channel_lock:
+                prev = self.gateway_channel_index.get(gateway_hex)
+                self.gateway_channel_index[gateway_hex] = learned_ch
+                if self._active_gateway is None:
+                    self._active_gateway = gateway_hex
+                    logger.info("Active gateway set to %s", gateway_hex)
+            if prev != learned_ch:
+                logger.info("Gateway %s: learned channel index %s", gateway_hex, learned_ch)
+
+        # If GPS position arrives while we are waiting, handle immediately (reply by DM)
+        self._maybe_handle_position_update(parsed, gateway_hex)
+
+        if not text:
             return
 
-        except Exception as e:
-            logger.error(f"Error processing message: {e}")
+        low = text.lower().strip()
+        # Per-message volume: debug-only, and guarded so the arguments are
+        # never even marshalled at the default INFO level.
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Processing message: text=%r, low=%r, is_public=%s, sender_num=%s", text, low, is_public, sender_num)
+
+        # One regex scan classifies the command and captures args.
+        # '/bot' keeps its historical anywhere-in-text match.
+        m = self._cmd_re.match(text.strip())
+        cmd = m.group('cmd').lower() if m else ""
+
+        if is_public:
+            # PUBLIC: nudge only
+            handler = self._public_dispatch.get(cmd)
+            if handler is None and "/bot" in low:
+                handler = self._handle_public_bot
+            if handler is not None:
+                handler(gateway_hex)
+            return
+
+        # PRIVATE: real work
+        handler = self._private_dispatch.get(cmd)
+        if handler is None and "/bot" in low:
+            handler = self._private_dispatch["/bot"]
+        if handler is not None:
+            if sender_num is not None:
+                args = (m.group('args') or "").strip() if m else ""
+                handler(gateway_hex, sender_num, args)
+            return
+
+        # If we're waiting for a typed location (DM only), treat the next DM message as a location attempt
+        if sender_num is not None and self.session_manager.has_pending_weather_request(sender_num):
+            attempt = text.strip()
+            loc = self.weather.resolve_location(attempt)
+            if not loc:
+                self._send_dm(gateway_hex, sender_num, LOCATION_PARSE_FAIL_MSG)
+                return
+            lat, lon, label = loc
+            self.session_manager.cache_location(sender_num, lat, lon, label)
+            self.session_manager.clear_pending_weather_request(sender_num)
+            self._send_weather_reply(gateway_hex, sender_num, lat, lon, label)
+            return
+
+        # If we're waiting for an email body (DM only), treat the next DM message as email body
+        if sender_num is not None and self.session_manager.is_waiting_for_email_body(sender_num):
+            if self._handle_email_body(gateway_hex, sender_num, text.strip()):
+                return
 
     def _on_disconnect(self, client, userdata, rc):
         logger.warning(f"Disconnected from MQTT broker with code: {rc}")
@@ -912,33 +1145,52 @@ class MeshtasticAIBot:
             return
 
         self.mqtt_client.loop_start()
+
+        # Event-driven poll on the shared loop instead of a thread blocking
+        # in time.sleep(30): the 30s cadence is a wait timeout, and anything
+        # that learns of new mail early can call wake_reply_poller() to
+        # trigger an immediate check.
+        poller = asyncio.run_coroutine_threadsafe(self._reply_poller(), self._loop)
         try:
-            while True:
-                # Check for pending email replies every 30 seconds
-                if hasattr(self, 'email_handler'):
-                    # Use the first available active gateway, or fall back to a default
-                    active_gateway = None
-                    if self.gateway_channel_index:
-                        # Use the first available gateway
-                        active_gateway = list(self.gateway_channel_index.keys())[0]
-                        logger.info(f"Using active gateway: {active_gateway}")
-                    else:
-                        # Fall back to a default gateway (this should be updated based on actual usage)
-                        active_gateway = "!1"
-                        logger.warning(f"No active gateways found, using fallback: {active_gateway}")
-                    
-                    logger.info(f"Checking for pending email replies using gateway: {active_gateway}")
-                    self._check_pending_email_replies(active_gateway)
-                else:
-                    logger.warning("Email handler not available in main loop")
-                time.sleep(30)
+            poller.result()
         except KeyboardInterrupt:
+            poller.cancel()
             self.stop()
 
+    async def _reply_poller(self):
+        self._reply_wake = asyncio.Event()
+        while True:
+            self._poll_pending_replies()
+            try:
+                await asyncio.wait_for(self._reply_wake.wait(), timeout=30)
+                self._reply_wake.clear()
+            except asyncio.TimeoutError:
+                pass
+
+    def wake_reply_poller(self):
+        """Thread-safe nudge: check for pending replies now, not in <=30s."""
+        if self._reply_wake is not None:
+            self._loop.call_soon_threadsafe(self._reply_wake.set)
+
+    def _poll_pending_replies(self):
+        if not hasattr(self, 'email_handler'):
+            logger.warning("Email handler not available in main loop")
+            return
+        # The cached gateway is set once when the first one is heard; no need
+        # to rebuild a key list every tick. Fallback default until then.
+        active_gateway = self._active_gateway
+        if active_gateway is None:
+            active_gateway = "!1"
+            logger.warning("No active gateways found, using fallback: !1")
+
+        self._check_pending_email_replies(active_gateway)
+        self._flush_publishes()
+
     def stop(self):
         if self.mqtt_client:
             self.mqtt_client.loop_stop()
             self.mqtt_client.disconnect()
+        self._loop.call_soon_threadsafe(self._loop.stop)
         logger.info("Bot stopped")
 
 
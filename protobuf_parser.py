@@ -4,7 +4,8 @@ This module handles the parsing of Meshtastic protobuf messages from MQTT.
 """
 
 import logging
-from typing import Optional, Dict, Any
+from dataclasses import dataclass
+from typing import Optional, Any
 
 logger = logging.getLogger(__name__)
 
@@ -17,29 +18,44 @@ except Exception as e:
     HAVE_PROTO = False
 
 
+@dataclass(slots=True)
+class ParsedPacket:
+    """Flattened view of a MeshPacket: slot reads instead of nested dicts."""
+    from_id: Any
+    to_id: Any
+    portnum: int
+    text: str
+    payload: str
+    length: int
+
+
 class ProtobufParser:
     """Parser for Meshtastic protobuf messages."""
 
     def __init__(self):
-        # Fallback numeric for TEXT_MESSAGE_APP in case import above failed
-        self.TEXT_MESSAGE_PORT = getattr(getattr(portnums_pb2, "PortNum", object()), "TEXT_MESSAGE_APP", 1)
+        if HAVE_PROTO:
+            self.TEXT_MESSAGE_PORT = getattr(getattr(portnums_pb2, "PortNum", object()), "TEXT_MESSAGE_APP", 1)
+            # The generated field names never change at runtime, so probe a
+            # throwaway packet once here instead of hasattr-scanning per message.
+            probe = mqtt_pb2.ServiceEnvelope().packet
+            self._from_attr = next(
+                (f for f in ("from", "fromId", "from_", "fromId_") if hasattr(probe, f)), None
+            )
+            self._decoded_has_text = hasattr(probe.decoded, "text")
+        else:
+            # Fallback numeric for TEXT_MESSAGE_APP when the import above failed
+            self.TEXT_MESSAGE_PORT = 1
+            self._from_attr = None
+            self._decoded_has_text = False
 
     # -------- public API --------
-    def parse_service_envelope(self, payload: bytes) -> Optional[Dict[str, Any]]:
+    def parse_service_envelope(self, payload: bytes) -> Optional[ParsedPacket]:
         """
         Parse a Meshtastic ServiceEnvelope protobuf message.
 
-        Returns a normalized dict like:
-        {
-          'from': '!12345678',     # or int id depending on firmware
-          'to':   0xFFFFFFFF,      # broadcast or a node id
-          'decoded': {
-              'portnum': 1,        # TEXT_MESSAGE_APP
-              'text': 'hello',     # if available as text
-              'payload': 'hello'   # utf-8 decoded from bytes if text missing
-          },
-          'length': <len>
-        }
+        Returns a ParsedPacket with from_id/to_id (int or '!hex' string
+        depending on firmware), the portnum, text (or utf-8 decoded payload
+        as fallback) and the envelope length.
         """
         if not HAVE_PROTO:
             return None
@@ -55,104 +71,47 @@ class ProtobufParser:
         # Pull out the MeshPacket
         pkt = env.packet
 
-        # Field 'from' is a Python keyword; generated code exposes it as attribute "from"
-        # Use getattr to be safe across versions; try 'from' and 'fromId'
-        from_id = None
-        for fname in ("from", "fromId", "from_", "fromId_"):
-            if hasattr(pkt, fname):
-                from_id = getattr(pkt, fname)
-                break
-
-        to_id = getattr(pkt, "to", None)
-
-        # Decoded data
-        decoded = getattr(pkt, "decoded", None)
-        portnum = None
-        text_str: Optional[str] = None
-        payload_str: str = ""
-
-        if decoded is not None:
-            # Port number enum
-            try:
-                portnum = int(getattr(decoded, "portnum"))
-            except Exception:
-                portnum = None
-
-            # Some firmware exposes 'text'; others only 'payload' as bytes
-            if hasattr(decoded, "text"):
-                try:
-                    text_val = getattr(decoded, "text")
-                    if isinstance(text_val, bytes):
-                        text_str = text_val.decode("utf-8", errors="ignore")
-                    else:
-                        text_str = str(text_val)
-                except Exception:
-                    text_str = None
-
-            # Always try payload bytes as fallback
-            try:
-                payload_bytes = getattr(decoded, "payload", b"")
-                if isinstance(payload_bytes, bytes):
-                    payload_str = payload_bytes.decode("utf-8", errors="ignore")
-                else:
-                    # Some versions might already be str
-                    payload_str = str(payload_bytes)
-            except Exception:
-                payload_str = ""
-
-        result = {
-            "from": from_id if from_id is not None else "unknown",
-            "to": to_id if to_id is not None else "unknown",
-            "decoded": {
-                "portnum": portnum if portnum is not None else 0,
-                "text": text_str or "",
-                "payload": payload_str,
-            },
-            "length": len(payload),
-        }
-        return result
-
-    def is_text_message(self, packet: Dict[str, Any]) -> bool:
+        # Field 'from' is a Python keyword; the attribute name the generated
+        # code exposes was resolved once in __init__.
+        from_id = getattr(pkt, self._from_attr, None) if self._from_attr else None
+
+        # Generated message classes guarantee these fields exist with zero
+        # defaults, so access them directly instead of getattr+try/except.
+        decoded = pkt.decoded
+        portnum = decoded.portnum
+
+        # Some firmware exposes 'text'; others only 'payload' as bytes
+        text_str = ""
+        if self._decoded_has_text:
+            text_val = decoded.text
+            text_str = text_val.decode("utf-8", errors="ignore") if isinstance(text_val, bytes) else str(text_val)
+
+        return ParsedPacket(
+            from_id=from_id if from_id is not None else "unknown",
+            to_id=pkt.to,
+            portnum=portnum,
+            text=text_str,
+            payload=decoded.payload.decode("utf-8", errors="ignore"),
+            length=len(payload),
+        )
+
+    def is_text_message(self, packet: ParsedPacket) -> bool:
         """True if packet is a text message (TEXT_MESSAGE_APP)."""
-        try:
-            portnum = int(packet.get("decoded", {}).get("portnum", 0))
-            return portnum == self.TEXT_MESSAGE_PORT
-        except Exception:
-            return False
+        return packet.portnum == self.TEXT_MESSAGE_PORT
 
-    def extract_text(self, packet: Dict[str, Any]) -> Optional[str]:
+    def extract_text(self, packet: ParsedPacket) -> Optional[str]:
         """Extract a UTF-8 string from text or payload."""
-        try:
-            decoded = packet.get("decoded", {})
-            text = decoded.get("text", "")
-            if text:
-                return text
-            payload = decoded.get("payload", "")
-            if payload:
-                return payload
-            return None
-        except Exception as e:
-            logger.debug(f"Text extraction failed: {e}")
-            return None
+        return packet.text or packet.payload or None
 
-    def is_public_message(self, packet: Dict[str, Any]) -> bool:
+    def is_public_message(self, packet: ParsedPacket) -> bool:
         """Public if 'to' equals 0xFFFFFFFF (broadcast)."""
-        try:
-            to_field = packet.get("to", "")
-            return to_field == 0xFFFFFFFF or str(to_field).lower() in ("0xffffffff", "ffffffff")
-        except Exception:
-            return False
+        to_field = packet.to_id
+        return to_field == 0xFFFFFFFF or str(to_field).lower() in ("0xffffffff", "ffffffff")
 
-    def get_sender_id(self, packet: Dict[str, Any]) -> str:
+    def get_sender_id(self, packet: ParsedPacket) -> str:
         """Return sender id as string (e.g., '!12345678' or numeric as str)."""
-        try:
-            return str(packet.get("from", "unknown"))
-        except Exception:
-            return "unknown"
+        return str(packet.from_id)
 
-    def get_recipient_id(self, packet: Dict[str, Any]) -> str:
+    def get_recipient_id(self, packet: ParsedPacket) -> str:
         """Return recipient id as string."""
-        try:
-            return str(packet.get("to", "unknown"))
-        except Exception:
-            return "unknown"
+        return str(packet.to_id)
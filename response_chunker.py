@@ -4,7 +4,7 @@ Handles splitting AI responses into appropriate chunk sizes for mesh transmissio
 """
 
 import logging
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 import re
 
 logger = logging.getLogger(__name__)
@@ -26,113 +26,124 @@ class ResponseChunker:
         self.word_boundary_pattern = re.compile(r'\b')
         self.sentence_end_pattern = re.compile(r'[.!?]\s+')
     
-    def chunk_text(self, text: str) -> List[str]:
+    def chunk_text(self, text: str, max_bytes: Optional[int] = None) -> List[str]:
         """
         Split text into chunks of appropriate size.
         
         Args:
             text: Text to chunk
+            max_bytes: Per-chunk byte limit override (defaults to max_chunk_bytes)
             
         Returns:
             List of text chunks
         """
         if not text:
             return []
-        
+
+        max_bytes = max_bytes or self.max_chunk_bytes
+
         # If text fits in one chunk, return as is
-        if self._get_byte_size(text) <= self.max_chunk_bytes:
+        if self._get_byte_size(text) <= max_bytes:
             return [text]
         
         chunks = []
-        current_chunk = ""
-        
+        current = []       # fragments of the chunk being built
+        current_bytes = 0
+
         # Split by sentences first for better readability
-        sentences = self._split_into_sentences(text)
-        
-        for sentence in sentences:
-            # Try to add the sentence to current chunk
-            test_chunk = current_chunk + sentence
-            
-            if self._get_byte_size(test_chunk) <= self.max_chunk_bytes:
-                current_chunk = test_chunk
+        for sentence in self._iter_sentences(text):
+            # Measure each sentence once and keep a running byte total:
+            # concatenation size is exactly the sum, so there is no need to
+            # re-encode the whole candidate chunk on every probe.
+            sentence_bytes = self._get_byte_size(sentence)
+
+            if current_bytes + sentence_bytes <= max_bytes:
+                current.append(sentence)
+                current_bytes += sentence_bytes
             else:
                 # Current chunk is full, save it and start new one
-                if current_chunk:
-                    chunks.append(current_chunk.strip())
-                    current_chunk = sentence
+                if current:
+                    chunks.append("".join(current).strip())
+                    current = [sentence]
+                    current_bytes = sentence_bytes
                 else:
                     # Single sentence is too long, split by words
-                    word_chunks = self._chunk_by_words(sentence)
+                    word_chunks = self._chunk_by_words(sentence, max_bytes)
                     chunks.extend(word_chunks)
-                    current_chunk = ""
-        
+                    current = []
+                    current_bytes = 0
+
         # Add the last chunk if it exists
-        if current_chunk:
-            chunks.append(current_chunk.strip())
+        if current:
+            chunks.append("".join(current).strip())
         
         # Validate chunks
-        validated_chunks = self._validate_chunks(chunks)
+        validated_chunks = self._validate_chunks(chunks, max_bytes)
         
         logger.debug(f"Chunked text into {len(validated_chunks)} chunks")
         return validated_chunks
     
-    def _split_into_sentences(self, text: str) -> List[str]:
+    def _iter_sentences(self, text: str):
         """
-        Split text into sentences for better chunking.
-        
+        Yield sentences one at a time for chunking.
+
+        Streams via finditer instead of materializing the full sentence
+        list, so chunking a multi-KB response never holds a second copy.
+
         Args:
             text: Text to split
-            
-        Returns:
-            List of sentences
+
+        Yields:
+            Sentences with normalized '. ' endings (last one kept as-is)
         """
-        # Split by sentence endings, but preserve the endings
-        sentences = self.sentence_end_pattern.split(text)
-        
-        # Reattach sentence endings (except for the last one)
-        result = []
-        for i, sentence in enumerate(sentences[:-1]):
+        last = 0
+        for m in self.sentence_end_pattern.finditer(text):
+            sentence = text[last:m.start()]
             if sentence.strip():
-                result.append(sentence + '. ')
-        
-        # Add the last sentence
-        if sentences[-1].strip():
-            result.append(sentences[-1])
-        
-        return result
+                yield sentence + '. '
+            last = m.end()
+        tail = text[last:]
+        if tail.strip():
+            yield tail
     
-    def _chunk_by_words(self, text: str) -> List[str]:
+    def _chunk_by_words(self, text: str, max_bytes: Optional[int] = None) -> List[str]:
         """
         Split long text by words when sentence-based chunking fails.
         
         Args:
             text: Text to split
+            max_bytes: Per-chunk byte limit override (defaults to max_chunk_bytes)
             
         Returns:
             List of word-based chunks
         """
+        max_bytes = max_bytes or self.max_chunk_bytes
         words = text.split()
         chunks = []
-        current_chunk = ""
-        
+        current = []
+        current_bytes = 0
+
         for word in words:
-            test_chunk = current_chunk + " " + word if current_chunk else word
-            
-            if self._get_byte_size(test_chunk) <= self.max_chunk_bytes:
-                current_chunk = test_chunk
+            word_bytes = self._get_byte_size(word)
+            separator = 1 if current else 0  # the joining space
+
+            if current_bytes + separator + word_bytes <= max_bytes:
+                current.append(word)
+                current_bytes += separator + word_bytes
             else:
                 # Current chunk is full
-                if current_chunk:
-                    chunks.append(current_chunk)
-                    current_chunk = word
+                if current:
+                    chunks.append(" ".join(current))
+                    current = [word]
+                    current_bytes = word_bytes
                 else:
                     # Single word is too long, truncate it
-                    truncated_word = self._truncate_to_bytes(word, self.max_chunk_bytes)
+                    truncated_word = self._truncate_to_bytes(word, max_bytes)
                     chunks.append(truncated_word)
-        
+
         # Add the last chunk
-        if current_chunk:
-            chunks.append(current_chunk)
+        if current:
+            chunks.append(" ".join(current))
         
         return chunks
     
@@ -149,22 +160,10 @@ class ResponseChunker:
         """
         if self._get_byte_size(text) <= max_bytes:
             return text
-        
-        # Binary search for the right length
-        left, right = 0, len(text)
-        best_length = 0
-        
-        while left <= right:
-            mid = (left + right) // 2
-            test_text = text[:mid]
-            
-            if self._get_byte_size(test_text) <= max_bytes:
-                best_length = mid
-                left = mid + 1
-            else:
-                right = mid - 1
-        
-        return text[:best_length]
+
+        # One encode, one slice, one decode: errors='ignore' drops the
+        # partial UTF-8 sequence a byte-boundary cut may leave at the end.
+        return text.encode('utf-8')[:max_bytes].decode('utf-8', errors='ignore')
     
     def _get_byte_size(self, text: str) -> int:
         """
@@ -178,16 +177,18 @@ class ResponseChunker:
         """
         return len(text.encode('utf-8'))
     
-    def _validate_chunks(self, chunks: List[str]) -> List[str]:
+    def _validate_chunks(self, chunks: List[str], max_bytes: Optional[int] = None) -> List[str]:
         """
         Validate and clean up chunks.
         
         Args:
             chunks: List of chunks to validate
+            max_bytes: Per-chunk byte limit override (defaults to max_chunk_bytes)
             
         Returns:
             Validated chunks
         """
+        max_bytes = max_bytes or self.max_chunk_bytes
         validated = []
         
         for chunk in chunks:
@@ -196,9 +197,9 @@ class ResponseChunker:
                 continue
             
             # Ensure chunk is within size limits
-            if self._get_byte_size(chunk) > self.max_chunk_bytes:
+            if self._get_byte_size(chunk) > max_bytes:
                 # Truncate if still too long
-                chunk = self._truncate_to_bytes(chunk, self.max_chunk_bytes)
+                chunk = self._truncate_to_bytes(chunk, max_bytes)
             
             # Only add chunks that meet minimum size
             if self._get_byte_size(chunk) >= self.min_chunk_bytes:
@@ -242,21 +243,25 @@ class ResponseChunker:
         if not text or target_chunks <= 1:
             return self.max_chunk_bytes
         
-        current_size = self.max_chunk_bytes
-        step = current_size // 4
-        
-        while step > 5:  # Minimum step size
-            chunks = self.chunk_text(text)
-            
-            if len(chunks) == target_chunks:
-                return current_size
-            elif len(chunks) > target_chunks:
+        # Binary search the per-chunk limit; the old loop adjusted a local
+        # size but always chunked at max_chunk_bytes, so it never converged.
+        lo, hi = self.min_chunk_bytes, self.max_chunk_bytes
+        best_size = self.max_chunk_bytes
+        best_diff = abs(len(self.chunk_text(text)) - target_chunks)
+
+        while lo <= hi:
+            mid = (lo + hi) // 2
+            count = len(self.chunk_text(text, max_bytes=mid))
+            diff = abs(count - target_chunks)
+            if diff < best_diff or (diff == best_diff and mid > best_size):
+                best_size, best_diff = mid, diff
+            if count == target_chunks:
+                return mid
+            if count > target_chunks:
                 # Too many chunks, increase size
-                current_size += step
+                lo = mid + 1
             else:
                 # Too few chunks, decrease size
-                current_size -= step
-            
-            step = step // 2
-        
-        return current_size
+                hi = mid - 1
+
+        return best_size
@@ -1,71 +1,98 @@
 """
 Session Manager for Meshtastic AI DM Bot.
 Handles user sessions, authentication, state, cached locations, and weather wait flags.
+Users are keyed by their numeric Meshtastic node id; all per-user state lives
+on one UserSession object so a handler call touches a single dict entry.
 """
 
 import time
 import logging
+import threading
 from typing import Dict, Optional, Tuple
 from dataclasses import dataclass
 
 logger = logging.getLogger(__name__)
 
+# Interval math (expiry, deadlines) uses the monotonic clock: immune to
+# NTP/DST wall-clock jumps and cheaper to read. Wall time is kept only
+# for created_at, which is reported to humans.
+_now = time.monotonic
 
-@dataclass
+# email_flags bits
+_EMAIL_RECIPIENT = 1
+_EMAIL_SUBJECT = 2
+_EMAIL_BODY = 4
+
+
+@dataclass(slots=True)
 class UserSession:
-    """Represents a user session."""
-    user_id: str
-    created_at: float
-    last_activity: float
+    """Represents a user session plus all per-user bot state."""
+    user_id: int
+    created_at: float               # wall clock, for display
+    last_activity_mono: float       # monotonic
     is_active: bool = True
+    # Weather state
+    weather_deadline: float = 0.0   # monotonic; 0 when not waiting
+    weather_pending: bool = False
+    cached_location: Optional[Tuple[float, float, str]] = None  # (lat, lon, label)
+    # Email state (flag bits above) and in-progress draft
+    email_flags: int = 0
+    email_draft: Optional[Dict] = None
 
     def update_activity(self):
-        self.last_activity = time.time()
+        self.last_activity_mono = _now()
 
     def is_expired(self, max_idle_time: int = 3600) -> bool:
-        return time.time() - self.last_activity > max_idle_time
+        return _now() - self.last_activity_mono > max_idle_time
 
 
 class SessionManager:
     """Manages user sessions for the bot, plus per-user weather state."""
 
     def __init__(self, session_timeout: int = 3600):
-        self.sessions: Dict[str, UserSession] = {}
+        # The single source of per-user state: one lookup per handler call
+        # instead of probing a dict per flag.
+        self.sessions: Dict[int, UserSession] = {}
+        # Handlers run on several worker threads: inserts and the cleanup
+        # sweep (which iterates sessions.items()) take this lock. Plain
+        # .get() reads and field writes on a UserSession stay lock-free —
+        # they're atomic under the GIL and on the hot path.
+        self._lock = threading.Lock()
         self.session_timeout = session_timeout
         self.cleanup_interval = 300  # every 5 minutes
-        self.last_cleanup = time.time()
-
-        # Weather-specific state
-        self._waiting_weather_deadline: Dict[str, float] = {}  # user_id -> deadline epoch
-        self._waiting_weather_pending: Dict[str, bool] = {}    # user_id -> has pending request
-        self._cached_locations: Dict[str, Tuple[float, float, str]] = {}  # user_id -> (lat, lon, label)
-        
-        # Email-specific state
-        self._waiting_email_recipient: Dict[str, bool] = {}    # user_id -> waiting for recipient email
-        self._waiting_email_subject: Dict[str, bool] = {}      # user_id -> waiting for email subject
-        self._waiting_email_body: Dict[str, bool] = {}         # user_id -> waiting for email body
-        self._email_draft: Dict[str, Dict] = {}               # user_id -> email draft data
+        self.last_cleanup = _now()
 
     # ---- basic sessions ----
 
-    def create_session(self, user_id: str) -> UserSession:
-        now = time.time()
-        if user_id in self.sessions:
-            s = self.sessions[user_id]
-            s.update_activity()
-            s.is_active = True
-            logger.info(f"Refreshed session for user: {user_id}")
-        else:
-            s = UserSession(user_id=user_id, created_at=now, last_activity=now)
-            self.sessions[user_id] = s
-            logger.info(f"Created new session for user: {user_id}")
+    def _get_or_create(self, user_id: int) -> UserSession:
+        """Fetch the user's session, creating an idle one on first access."""
+        with self._lock:
+            s = self.sessions.get(user_id)
+            if s is None:
+                s = UserSession(user_id=user_id, created_at=time.time(), last_activity_mono=_now())
+                self.sessions[user_id] = s
         return s
 
-    def get_session(self, user_id: str) -> Optional[UserSession]:
+    def create_session(self, user_id: int) -> UserSession:
+        with self._lock:
+            s = self.sessions.get(user_id)
+            if s is not None:
+                s.update_activity()
+                s.is_active = True
+                logger.info(f"Refreshed session for user: {user_id}")
+            else:
+                s = UserSession(user_id=user_id, created_at=time.time(), last_activity_mono=_now())
+                self.sessions[user_id] = s
+                logger.info(f"Created new session for user: {user_id}")
+        return s
+
+    def get_session(self, user_id: int) -> Optional[UserSession]:
         s = self.sessions.get(user_id)
         if not s:
             return None
-        if s.is_expired(self.session_timeout):
+        # Inline expiry check; is_expired would cost a method dispatch and a
+        # second clock read per lookup.
+        if _now() - s.last_activity_mono > self.session_timeout:
             s.is_active = False
             logger.info(f"Session expired for user: {user_id}")
             return None
@@ -74,10 +101,10 @@ class SessionManager:
         s.update_activity()
         return s
 
-    def has_active_session(self, user_id: str) -> bool:
+    def has_active_session(self, user_id: int) -> bool:
         return self.get_session(user_id) is not None
 
-    def end_session(self, user_id: str) -> bool:
+    def end_session(self, user_id: int) -> bool:
         if user_id in self.sessions:
             self.sessions[user_id].is_active = False
             logger.info(f"Ended session for user: {user_id}")
@@ -87,128 +114,171 @@ class SessionManager:
     # ---- cleanup ----
 
     def cleanup_expired_sessions(self):
-        now = time.time()
+        now = _now()
         if now - self.last_cleanup < self.cleanup_interval:
             return
-        expired = [u for u, s in self.sessions.items() if s.is_expired(self.session_timeout)]
-        for u in expired:
-            del self.sessions[u]
+        # Locals in the sweep loop: LOAD_FAST instead of attribute lookups.
+        # The lock keeps a worker's insert from landing mid-iteration.
+        timeout = self.session_timeout
+        with self._lock:
+            expired = [u for u, s in self.sessions.items() if now - s.last_activity_mono > timeout]
+            if expired:
+                if len(expired) > len(self.sessions) // 2:
+                    # Mostly dead: rebuilding hashes each survivor once instead
+                    # of re-hashing every expired key for deletion.
+                    drop = set(expired)
+                    self.sessions = {u: s for u, s in self.sessions.items() if u not in drop}
+                else:
+                    pop = self.sessions.pop
+                    for u in expired:
+                        pop(u, None)
         if expired:
             logger.info(f"Cleaned up {len(expired)} expired sessions")
         self.last_cleanup = now
 
     # ---- weather helpers ----
 
-    def set_waiting_for_weather_location(self, user_id: str, waiting: bool, timeout_sec: int = 20):
+    def set_waiting_for_weather_location(self, user_id: int, waiting: bool, timeout_sec: int = 20):
         if waiting:
-            self._waiting_weather_deadline[user_id] = time.time() + timeout_sec
-            self._waiting_weather_pending[user_id] = True
+            s = self._get_or_create(user_id)
+            s.weather_deadline = _now() + timeout_sec
+            s.weather_pending = True
         else:
-            self._waiting_weather_deadline.pop(user_id, None)
-            self._waiting_weather_pending.pop(user_id, None)
+            s = self.sessions.get(user_id)
+            if s is not None:
+                s.weather_deadline = 0.0
+                s.weather_pending = False
 
-    def is_waiting_for_weather_location(self, user_id: str) -> bool:
+    def is_waiting_for_weather_location(self, user_id: int) -> bool:
         """True when we are waiting *and* still within the timeout window."""
-        deadline = self._waiting_weather_deadline.get(user_id)
-        if not deadline:
+        s = self.sessions.get(user_id)
+        if s is None or not s.weather_deadline:
             return False
-        if time.time() > deadline:
+        if _now() > s.weather_deadline:
             # Do not auto-clear pending flag here; timer will handle user messaging.
             return False
         return True
 
-    def has_pending_weather_request(self, user_id: str) -> bool:
+    def has_pending_weather_request(self, user_id: int) -> bool:
         """True if a weather location request is outstanding (until explicitly cleared)."""
-        return self._waiting_weather_pending.get(user_id, False)
+        s = self.sessions.get(user_id)
+        return s is not None and s.weather_pending
 
-    def clear_pending_weather_request(self, user_id: str):
-        self._waiting_weather_pending.pop(user_id, None)
-        self._waiting_weather_deadline.pop(user_id, None)
+    def clear_pending_weather_request(self, user_id: int):
+        s = self.sessions.get(user_id)
+        if s is not None:
+            s.weather_pending = False
+            s.weather_deadline = 0.0
 
-    def cache_location(self, user_id: str, lat: float, lon: float, label: str):
-        self._cached_locations[user_id] = (lat, lon, label)
+    def cache_location(self, user_id: int, lat: float, lon: float, label: str):
+        self._get_or_create(user_id).cached_location = (lat, lon, label)
 
-    def get_cached_location(self, user_id: str) -> Optional[Tuple[float, float, str]]:
-        return self._cached_locations.get(user_id)
+    def get_cached_location(self, user_id: int) -> Optional[Tuple[float, float, str]]:
+        s = self.sessions.get(user_id)
+        return s.cached_location if s is not None else None
 
-    def clear_cached_location(self, user_id: str):
+    def clear_cached_location(self, user_id: int):
         """Forget cached location and any pending weather wait for this user."""
-        self._cached_locations.pop(user_id, None)
-        self.clear_pending_weather_request(user_id)
-    
+        s = self.sessions.get(user_id)
+        if s is not None:
+            s.cached_location = None
+            s.weather_pending = False
+            s.weather_deadline = 0.0
+
     # ---- email helpers ----
-    
-    def set_waiting_for_email_recipient(self, user_id: str, waiting: bool):
-        """Set whether user is waiting to provide email recipient."""
+
+    def _set_email_flag(self, user_id: int, bit: int, waiting: bool):
         if waiting:
-            self._waiting_email_recipient[user_id] = True
+            self._get_or_create(user_id).email_flags |= bit
         else:
-            self._waiting_email_recipient.pop(user_id, None)
-    
-    def set_waiting_for_email_subject(self, user_id: str, waiting: bool):
+            s = self.sessions.get(user_id)
+            if s is not None:
+                s.email_flags &= ~bit
+
+    def set_waiting_for_email_recipient(self, user_id: int, waiting: bool):
+        """Set whether user is waiting to provide email recipient."""
+        self._set_email_flag(user_id, _EMAIL_RECIPIENT, waiting)
+
+    def set_waiting_for_email_subject(self, user_id: int, waiting: bool):
         """Set whether user is waiting to provide email subject."""
-        if waiting:
-            self._waiting_email_subject[user_id] = True
-        else:
-            self._waiting_email_subject.pop(user_id, None)
-    
-    def set_waiting_for_email_body(self, user_id: str, waiting: bool):
+        self._set_email_flag(user_id, _EMAIL_SUBJECT, waiting)
+
+    def set_waiting_for_email_body(self, user_id: int, waiting: bool):
         """Set whether user is waiting to provide email body."""
-        if waiting:
-            self._waiting_email_body[user_id] = True
-        else:
-            self._waiting_email_body.pop(user_id, None)
-    
-    def is_waiting_for_email_recipient(self, user_id: str) -> bool:
+        self._set_email_flag(user_id, _EMAIL_BODY, waiting)
+
+    def is_waiting_for_email_recipient(self, user_id: int) -> bool:
         """Check if user is waiting to provide email recipient."""
-        return self._waiting_email_recipient.get(user_id, False)
-    
-    def is_waiting_for_email_subject(self, user_id: str) -> bool:
+        s = self.sessions.get(user_id)
+        return s is not None and bool(s.email_flags & _EMAIL_RECIPIENT)
+
+    def is_waiting_for_email_subject(self, user_id: int) -> bool:
         """Check if user is waiting to provide email subject."""
-        return self._waiting_email_subject.get(user_id, False)
-    
-    def is_waiting_for_email_body(self, user_id: str) -> bool:
+        s = self.sessions.get(user_id)
+        return s is not None and bool(s.email_flags & _EMAIL_SUBJECT)
+
+    def is_waiting_for_email_body(self, user_id: int) -> bool:
         """Check if user is waiting to provide email body."""
-        return self._waiting_email_body.get(user_id, False)
-    
-    def set_email_draft(self, user_id: str, draft_data: Dict):
+        s = self.sessions.get(user_id)
+        return s is not None and bool(s.email_flags & _EMAIL_BODY)
+
+    def set_email_draft(self, user_id: int, draft_data: Dict):
         """Set email draft data for a user."""
-        self._email_draft[user_id] = draft_data
-    
-    def get_email_draft(self, user_id: str) -> Optional[Dict]:
+        self._get_or_create(user_id).email_draft = draft_data
+
+    def get_email_draft(self, user_id: int) -> Optional[Dict]:
         """Get email draft data for a user."""
-        return self._email_draft.get(user_id)
-    
-    def clear_email_draft(self, user_id: str):
+        s = self.sessions.get(user_id)
+        return s.email_draft if s is not None else None
+
+    def clear_email_draft(self, user_id: int):
         """Clear email draft data for a user."""
-        self._email_draft.pop(user_id, None)
-    
-    def clear_all_email_states(self, user_id: str):
+        s = self.sessions.get(user_id)
+        if s is not None:
+            s.email_draft = None
+
+    def clear_all_email_states(self, user_id: int):
         """Clear all email-related states for a user."""
-        self.set_waiting_for_email_recipient(user_id, False)
-        self.set_waiting_for_email_subject(user_id, False)
-        self.set_waiting_for_email_body(user_id, False)
-        self.clear_email_draft(user_id)
+        s = self.sessions.get(user_id)
+        if s is not None:
+            s.email_flags = 0
+            s.email_draft = None
 
     # ---- info helpers ----
 
     def get_active_session_count(self) -> int:
         self.cleanup_expired_sessions()
-        return len([s for s in self.sessions.values() if s.is_active])
+        with self._lock:
+            return sum(1 for s in self.sessions.values() if s.is_active)
 
-    def get_session_info(self, user_id: str) -> Optional[Dict]:
+    def get_session_info(self, user_id: int) -> Optional[Dict]:
         s = self.get_session(user_id)
         if not s:
             return None
         return {
             "user_id": s.user_id,
             "created_at": s.created_at,
-            "last_activity": s.last_activity,
             "is_active": s.is_active,
             "age_seconds": time.time() - s.created_at,
-            "idle_seconds": time.time() - s.last_activity,
+            "idle_seconds": _now() - s.last_activity_mono,
         }
 
-    def list_active_sessions(self) -> Dict[str, Dict]:
+    def list_active_sessions(self) -> Dict[int, Dict]:
+        # One pass over sessions.items(); going through get_session_info
+        # would re-hash every key and bump activity just for a listing.
         self.cleanup_expired_sessions()
-        return {u: self.get_session_info(u) for u, s in self.sessions.items() if s.is_active}
+        now_wall = time.time()
+        now = _now()
+        timeout = self.session_timeout
+        with self._lock:
+            return {
+                u: {
+                    "user_id": u,
+                    "created_at": s.created_at,
+                    "is_active": s.is_active,
+                    "age_seconds": now_wall - s.created_at,
+                    "idle_seconds": now - s.last_activity_mono,
+                }
+                for u, s in self.sessions.items()
+                if s.is_active and now - s.last_activity_mono <= timeout
+            }
@@ -3,19 +3,64 @@ Weather Handler for Meshtastic AI DM Bot.
 Resolves human/place input to coordinates and fetches forecast via Open-Meteo.
 """
 
+import json
 import logging
+import time
 import unicodedata
-from datetime import datetime, timedelta
+from bisect import bisect_right
+from datetime import datetime
 from typing import Optional, Tuple, List, Dict
 import requests
+from requests.adapters import HTTPAdapter, Retry
+
+# orjson is optional; it parses the 2-5KB geocode/forecast bodies ~3x faster
+try:
+    import orjson
+    HAVE_ORJSON = True
+except ImportError:
+    HAVE_ORJSON = False
 
 logger = logging.getLogger(__name__)
 
+# Geocode cache sizing: positive entries live for the process, failed
+# lookups are retried after a short TTL so outages don't stick forever.
+_GEO_CACHE_MAX = 512
+_GEO_NEG_TTL = 60.0
+
+# Nominatim address keys in preference order; scanned with next() so the
+# lookup short-circuits on the first non-empty hit.
+_CITY_KEYS = ("city", "town", "village", "municipality")
+_ADMIN_KEYS = ("state", "county", "region")
+
+# Forecast cache: weather doesn't move inside ten minutes, and users
+# clustered in one area resolve to the same ~1km bucket.
+_FX_CACHE_MAX = 256
+_FX_TTL = 600.0
+
+# English day/month names for forecast lines: table lookups instead of
+# strftime, which re-parses its pattern and consults the locale per call.
+_DAYS = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+_MONTHS = ("Jan", "Feb", "Mar", "Apr", "May", "Jun",
+           "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
+
+
+_normalize = unicodedata.normalize
+
+
+def _json_loads(raw):
+    # resp.content + orjson skips requests' charset detection in resp.json().
+    return orjson.loads(raw) if HAVE_ORJSON else json.loads(raw)
+
 
 def _ascii_clean(s: str) -> str:
     """Normalize Unicode and drop non-ASCII so Meshtastic apps don't render garbage."""
+    if not s:
+        return s
+    # Pure-ASCII input (the common case) needs no NFKD pass.
+    if s.isascii():
+        return s.strip()
     try:
-        return unicodedata.normalize("NFKD", s).encode("ascii", "ignore").decode().strip()
+        return _normalize("NFKD", s).encode("ascii", "ignore").decode().strip()
     except Exception:
         return s
 
@@ -44,14 +89,60 @@ class WeatherHandler:
     NOMINATIM_REVERSE = "https://nominatim.openstreetmap.org/reverse"
     METEO_URL = "https://api.open-meteo.com/v1/forecast"
 
+    def __init__(self):
+        # Keep TCP+TLS connections to Nominatim and Open-Meteo alive between
+        # calls; a weather query otherwise pays 2-3 cold HTTPS handshakes.
+        self._http = requests.Session()
+        self._http.mount("https://", HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=8,
+            max_retries=Retry(total=2, backoff_factor=0.3),
+        ))
+        self._http.headers.update({"User-Agent": "MeshtasticBot/1.0", "Accept-Language": "en"})
+        # Repeat queries ("Plovdiv") and near-identical cached coordinates
+        # are common, each costs an HTTP round trip, and Nominatim
+        # rate-limits at 1 req/s — cache both directions in memory.
+        # value: (retry_after or None for a keeper, result)
+        self._geo_cache: Dict[str, Tuple[Optional[float], Optional[Tuple[float, float, str]]]] = {}
+        self._rev_cache: Dict[Tuple[float, float], Tuple[Optional[float], Optional[str]]] = {}
+        # (rounded lat, lon) -> (fetched_at monotonic, (hourly, daily))
+        self._fx_cache: Dict[Tuple[float, float], Tuple[float, Tuple[List[str], List[str]]]] = {}
+
+    @staticmethod
+    def _cache_get(cache, key):
+        hit = cache.get(key)
+        if hit is None:
+            return None
+        retry_after, result = hit
+        if retry_after is not None and time.monotonic() >= retry_after:
+            del cache[key]
+            return None
+        return hit
+
+    @staticmethod
+    def _cache_put(cache, key, result):
+        if len(cache) >= _GEO_CACHE_MAX:
+            # Dicts iterate in insertion order; dropping the first entry
+            # gives cheap FIFO eviction without an LRU structure.
+            cache.pop(next(iter(cache)))
+        cache[key] = (None if result is not None else time.monotonic() + _GEO_NEG_TTL, result)
+
     # --- location resolution ---
 
     def resolve_location(self, query: str) -> Optional[Tuple[float, float, str]]:
-        """Resolve 'lat,lon' or free text into (lat, lon, label)."""
+        """Resolve 'lat,lon' or free text into (lat, lon, label). Cached."""
         if not query:
             return None
         q = query.strip()
+        key = q.lower()
+        hit = self._cache_get(self._geo_cache, key)
+        if hit is not None:
+            return hit[1]
+        result = self._resolve_uncached(q)
+        self._cache_put(self._geo_cache, key, result)
+        return result
 
+    def _resolve_uncached(self, q: str) -> Optional[Tuple[float, float, str]]:
         # Try explicit lat,lon first
         if "," in q:
             parts = [p.strip() for p in q.split(",")]
@@ -66,22 +157,21 @@ class WeatherHandler:
 
         # Fallback to Nominatim geocoding
         try:
-            resp = requests.get(
+            resp = self._http.get(
                 self.NOMINATIM_SEARCH,
                 params={"q": q, "format": "json", "limit": 1, "addressdetails": 1},
-                headers={"User-Agent": "MeshtasticBot/1.0", "Accept-Language": "en"},
                 timeout=12,
             )
             resp.raise_for_status()
-            results = resp.json()
+            results = _json_loads(resp.content)
             if results:
                 r0 = results[0]
                 lat = float(r0["lat"])
                 lon = float(r0["lon"])
                 addr: Dict = r0.get("address", {}) or {}
 
-                city = addr.get("city") or addr.get("town") or addr.get("village") or addr.get("municipality") or ""
-                admin = addr.get("state") or addr.get("county") or addr.get("region") or ""
+                city = next((addr[k] for k in _CITY_KEYS if addr.get(k)), "")
+                admin = next((addr[k] for k in _ADMIN_KEYS if addr.get(k)), "")
                 country = (addr.get("country_code") or "").upper() or addr.get("country", "")
 
                 if not (city or admin):
@@ -97,19 +187,28 @@ class WeatherHandler:
         return None
 
     def reverse_label(self, lat: float, lon: float) -> Optional[str]:
-        """Reverse-geocode a clean ASCII label for given coordinates."""
+        """Reverse-geocode a clean ASCII label for given coordinates. Cached
+        at ~110m resolution (3 decimal places)."""
+        key = (round(lat, 3), round(lon, 3))
+        hit = self._cache_get(self._rev_cache, key)
+        if hit is not None:
+            return hit[1]
+        label = self._reverse_uncached(lat, lon)
+        self._cache_put(self._rev_cache, key, label)
+        return label
+
+    def _reverse_uncached(self, lat: float, lon: float) -> Optional[str]:
         try:
-            r = requests.get(
+            r = self._http.get(
                 self.NOMINATIM_REVERSE,
                 params={"lat": lat, "lon": lon, "format": "json", "zoom": 10, "addressdetails": 1},
-                headers={"User-Agent": "MeshtasticBot/1.0", "Accept-Language": "en"},
                 timeout=12,
             )
             r.raise_for_status()
-            data = r.json()
+            data = _json_loads(r.content)
             addr = data.get("address", {}) or {}
-            city = addr.get("city") or addr.get("town") or addr.get("village") or addr.get("municipality") or ""
-            admin = addr.get("state") or addr.get("county") or addr.get("region") or ""
+            city = next((addr[k] for k in _CITY_KEYS if addr.get(k)), "")
+            admin = next((addr[k] for k in _ADMIN_KEYS if addr.get(k)), "")
             country = (addr.get("country_code") or "").upper() or addr.get("country", "")
             return label_from_address(city, admin, country, fallback=f"{lat:.4f},{lon:.4f}")
         except Exception as e:
@@ -121,53 +220,69 @@ class WeatherHandler:
     def fetch_forecast_lines(self, lat: float, lon: float) -> Tuple[List[str], List[str]]:
         """
         Fetch hourly (next 6 hours) and daily (next 3 days) forecast lines.
-        Returns (hourly_lines, daily_lines).
+        Returns (hourly_lines, daily_lines). Cached for 10 minutes per
+        ~1km coordinate bucket; failures are never cached.
         """
+        key = (round(lat, 2), round(lon, 2))
+        hit = self._fx_cache.get(key)
+        if hit is not None and time.monotonic() - hit[0] < _FX_TTL:
+            return hit[1]
         try:
-            params = {
-                "latitude": lat,
-                "longitude": lon,
-                "hourly": "temperature_2m,precipitation_probability",
-                "daily": "temperature_2m_max,temperature_2m_min,precipitation_probability_max",
-                "forecast_days": 4,  # today + next 3
-                "timezone": "auto",
-            }
-            r = requests.get(self.METEO_URL, params=params, timeout=12)
-            r.raise_for_status()
-            data = r.json()
-
-            # Hourly → start from next full hour (local tz), show next 6 hours
-            now = datetime.now()
-            times = [datetime.fromisoformat(t) for t in data["hourly"]["time"]]
-            temps = data["hourly"]["temperature_2m"]
-            precs = data["hourly"]["precipitation_probability"]
-
-            hourly: List[str] = []
-            end_by = now + timedelta(hours=6, minutes=1)
-            for t, temp, prec in zip(times, temps, precs):
-                if t <= now:
-                    continue
-                if t > end_by:
-                    break
-                hourly.append(f"{t.strftime('%H:00')} {int(round(temp))}C, {prec}%")
-            if not hourly:
-                hourly = ["(no hourly data)"]
-
-            # Daily — next 3 days (skip today index 0)
-            daily: List[str] = []
-            for t, tmax, tmin, pmax in zip(
-                data["daily"]["time"][1:4],
-                data["daily"]["temperature_2m_max"][1:4],
-                data["daily"]["temperature_2m_min"][1:4],
-                data["daily"]["precipitation_probability_max"][1:4],
-            ):
-                dt = datetime.fromisoformat(t)
-                daily.append(f"{dt.strftime('%a %d %b')}: {int(round(tmin))}-{int(round(tmax))}C, {pmax}%")
-            if not daily:
-                daily = ["(no daily data)"]
-
-            return hourly, daily
-
+            result = self._fetch_forecast_uncached(lat, lon)
         except Exception as e:
             logger.error(f"Open-Meteo error: {e}")
             return ["(failed to fetch hourly)"], ["(failed to fetch daily)"]
+        if len(self._fx_cache) >= _FX_CACHE_MAX:
+            self._fx_cache.pop(next(iter(self._fx_cache)))
+        self._fx_cache[key] = (time.monotonic(), result)
+        return result
+
+    def _fetch_forecast_uncached(self, lat: float, lon: float) -> Tuple[List[str], List[str]]:
+        params = {
+            "latitude": lat,
+            "longitude": lon,
+            "hourly": "temperature_2m,precipitation_probability",
+            "daily": "temperature_2m_max,temperature_2m_min,precipitation_probability_max",
+            "forecast_days": 4,  # today + next 3
+            "timezone": "auto",
+        }
+        r = self._http.get(self.METEO_URL, params=params, timeout=12)
+        r.raise_for_status()
+        data = _json_loads(r.content)
+
+        # Hourly → start from next full hour (local tz), show next 6 hours.
+        # The API returns sorted ISO strings, which compare correctly as
+        # strings: bisect to the first future hour and slice, instead of
+        # datetime-parsing all ~96 entries to keep 6. The displayed hour
+        # is just characters 11:13 of the raw timestamp.
+        times_raw = data["hourly"]["time"]
+        temps = data["hourly"]["temperature_2m"]
+        precs = data["hourly"]["precipitation_probability"]
+
+        now_iso = datetime.now().isoformat(timespec="minutes")
+        start = bisect_right(times_raw, now_iso)
+        hourly: List[str] = []
+        for t_raw, temp, prec in zip(
+            times_raw[start:start + 6], temps[start:start + 6], precs[start:start + 6]
+        ):
+            hourly.append(f"{t_raw[11:13]}:00 {int(round(temp))}C, {prec}%")
+        if not hourly:
+            hourly = ["(no hourly data)"]
+
+        # Daily — next 3 days (skip today index 0)
+        daily: List[str] = []
+        for t, tmax, tmin, pmax in zip(
+            data["daily"]["time"][1:4],
+            data["daily"]["temperature_2m_max"][1:4],
+            data["daily"]["temperature_2m_min"][1:4],
+            data["daily"]["precipitation_probability_max"][1:4],
+        ):
+            dt = datetime.fromisoformat(t)
+            daily.append(
+                f"{_DAYS[dt.weekday()]} {dt.day:02d} {_MONTHS[dt.month - 1]}: "
+                f"{int(round(tmin))}-{int(round(tmax))}C, {pmax}%"
+            )
+        if not daily:
+            daily = ["(no daily data)"]
+
+        return hourly, daily